@@ -0,0 +1,72 @@
+"""
+Compare the DataFrame + applymap preprocessing used by the evaluators before with the
+columnar loader (encode_bindings) on synthetic SPARQL JSON bindings.
+
+    python -m benchmarks.bench_columnar_loader --rows 10000 --columns 4
+"""
+import argparse
+import random
+import time
+import warnings
+
+import pandas as pd
+
+from functions.result_store import ValueInterner, encode_bindings
+
+
+def make_bindings(rows, columns, distinct, seed=0):
+    rng = random.Random(seed)
+    variables = [f"var{i}" for i in range(columns)]
+    return [
+        {var: {"type": "uri", "value": f"http://example.org/{rng.randrange(distinct)}"} for var in variables}
+        for _ in range(rows)
+    ]
+
+
+def convert_to_numeric(value):
+    # 以前の evaluator が使っていたセル変換 (数値はそのまま、それ以外は hash())
+    if pd.api.types.is_numeric_dtype(type(value)):
+        return value
+    return hash(value)
+
+
+def applymap_path(bindings):
+    # 以前の evaluate_jaccard と jaccard_index_vectorized の前処理
+    df = pd.DataFrame(bindings)
+    df = df.applymap(lambda x: x["value"] if isinstance(x, dict) and "value" in x else x)
+    return df.fillna(float("inf")).applymap(convert_to_numeric).astype("float64").values
+
+
+def columnar_path(bindings):
+    return encode_bindings(bindings, ValueInterner())[1]
+
+
+def best_of(func, bindings, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func(bindings)
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=10000)
+    parser.add_argument("--columns", type=int, default=4)
+    parser.add_argument("--distinct", type=int, default=5000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    warnings.simplefilter("ignore", FutureWarning)
+    bindings = make_bindings(args.rows, args.columns, args.distinct)
+    before = best_of(applymap_path, bindings, args.repeat)
+    after = best_of(columnar_path, bindings, args.repeat)
+    print(f"rows={args.rows} columns={args.columns}")
+    print(f"applymap : {before * 1000:8.1f} ms")
+    print(f"columnar : {after * 1000:8.1f} ms")
+    print(f"speedup  : {before / after:8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
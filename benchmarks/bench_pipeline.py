@@ -0,0 +1,171 @@
+"""
+Offline throughput and latency of the benchmark stages (sparql_gen, execute_query, evaluate_jaccard)
+with a stub LLM replaying recorded outputs and a stub SPARQL endpoint; needs no network access.
+
+    python -m benchmarks.bench_pipeline --database rhea --scale 1000 --workers 8
+    python -m benchmarks.bench_pipeline --generator rdf-config   # LLM spec + local rdf-config (needs Ruby)
+
+The "finetuned" generator (default) replays the assistant SPARQL of dataset_for_finetuning/*.jsonl
+for the questions it covers. Gold results are served from --results (questions JSON saved with
+"results") when given, otherwise synthesized deterministically from the query text.
+"""
+from concurrent.futures import ThreadPoolExecutor
+import argparse
+import copy
+import json
+import os
+import time
+
+from benchmarks.stubs import (
+    REPO_DIR,
+    StubLLMServer,
+    StubSparqlEndpoint,
+    configure_stub_environment,
+    recorded_results,
+    synthetic_results,
+)
+from functions.gpt_excute import DEFAULT_MODEL_NAME, create_chat_completion
+from functions.prompt_maker import DEFAULT_PROMPT_IDS, make_prompt
+from functions.results_evaluater import evaluate_jaccard
+from functions.SPARQL_executer import execute_queries
+from functions.SPARQL_generator import sparql_gen
+from functions.tracing import enable_tracing, summarize_trace, trace_context, trace_span
+
+# demo_finetuning.ipynb のシステムプロンプト
+FINETUNED_SYSTEM_PROMPT = "Create a SPARQL query to retrieve values from the database for the user question"
+
+# 段階ごとに 1 問あたりのレイテンシを取る span
+STAGE_SPANS = {"sparql_gen": {"finetuned": "llm", "rdf-config": "sparql_gen"}, "execute_query": "query", "evaluate_jaccard": "score"}
+
+
+def scale_questions(questions, scale):
+    """
+    Repeat questions (with "#k" id suffixes) or cut them to `scale` questions.
+    """
+    scaled = []
+    for i in range(scale):
+        question = copy.deepcopy(questions[i % len(questions)])
+        if i >= len(questions):
+            question["id"] = f"{question['id']}#{i // len(questions)}"
+        scaled.append(question)
+    return scaled
+
+
+def generate_finetuned(questions, workers):
+    def run(question):
+        with trace_context(question_id=question["id"]), trace_span("llm"):
+            completion = create_chat_completion(
+                [
+                    {"role": "system", "content": FINETUNED_SYSTEM_PROMPT},
+                    {"role": "user", "content": question["user_question"]},
+                ],
+                os.environ.get("OPENAI_MODEL", DEFAULT_MODEL_NAME),
+                {},
+            )
+        question["llm_rdf_result"] = completion.choices[0].message.content
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        list(executor.map(run, questions))
+
+
+def timed_stage(tracer, name, span_name, n_questions, call):
+    first = len(tracer.records)
+    started = time.perf_counter()
+    call()
+    wall = time.perf_counter() - started
+    spans = [r for r in tracer.records[first:] if r["stage"] == span_name]
+    row = {"stage": name, "questions": n_questions, "seconds": wall, "throughput": n_questions / wall if wall > 0 else 0}
+    if spans:
+        summary = summarize_trace(spans, group_by=("stage",))[0]
+        row.update({key: summary[key] for key in ("count", "errors", "p50", "p95", "max")})
+    return row
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database", default="rhea", choices=sorted(DEFAULT_PROMPT_IDS))
+    parser.add_argument("--scale", type=int, help="number of questions (default: every usable question once)")
+    parser.add_argument("--generator", default="finetuned", choices=["finetuned", "rdf-config"])
+    parser.add_argument("--workers", type=int, default=8, help="concurrent generations and queries")
+    parser.add_argument("--llm-latency", type=float, default=0.0, help="stub LLM response time [s]")
+    parser.add_argument("--endpoint-latency", type=float, default=0.0, help="stub endpoint response time [s]")
+    parser.add_argument("--rows", type=int, default=20, help="max rows of a synthetic result")
+    parser.add_argument("--results", help="questions JSON with recorded gold results")
+    parser.add_argument("--json", help="write the measurements to this file")
+    args = parser.parse_args()
+
+    with open(os.path.join(REPO_DIR, "questions", "json_format", f"{args.database}.json"), "r") as f:
+        questions = json.load(f)
+    fallback = synthetic_results(rows=args.rows)
+    results = fallback
+    if args.results:
+        with open(args.results, "r") as f:
+            results = recorded_results(json.load(f), fallback=fallback)
+
+    with StubLLMServer(args.llm_latency) as llm, StubSparqlEndpoint(results, args.endpoint_latency) as endpoint:
+        configure_stub_environment(llm, endpoint, [args.database])
+        if args.generator == "finetuned":
+            # 記録された出力がある質問だけを使う
+            questions = [q for q in questions if q["user_question"].strip() in llm.outputs["sparql"]]
+        questions = scale_questions(questions, args.scale or len(questions))
+        answers = copy.deepcopy(questions)
+        # 正解の結果は計測に含めない
+        execute_queries(answers, endpoint.url, "sparql", 10000, "", max_workers=args.workers, max_in_flight=args.workers)
+
+        tracer = enable_tracing()
+        rows = []
+        if args.generator == "finetuned":
+            generate = lambda: generate_finetuned(questions, args.workers)
+        else:
+            prompt_id, prompt_variable_id = DEFAULT_PROMPT_IDS[args.database]
+            make_prompt(args.database, prompt_id, prompt_variable_id, questions)
+            generate = lambda: sparql_gen(args.database, questions, max_workers=args.workers)
+        span_name = STAGE_SPANS["sparql_gen"][args.generator]
+        rows.append(timed_stage(tracer, "sparql_gen", span_name, len(questions), generate))
+        for question in questions:
+            # 生成に失敗した質問も実行段階に含める
+            question.setdefault("llm_rdf_result", "")
+        rows.append(
+            timed_stage(
+                tracer, "execute_query", STAGE_SPANS["execute_query"], len(questions),
+                lambda: execute_queries(
+                    questions, endpoint.url, "llm_rdf_result", 10000, "",
+                    max_workers=args.workers, max_in_flight=args.workers,
+                ),
+            )
+        )
+        scores = {}
+        rows.append(
+            timed_stage(
+                tracer, "evaluate_jaccard", STAGE_SPANS["evaluate_jaccard"], len(questions),
+                lambda: scores.update(evaluate_jaccard(questions, answers)),
+            )
+        )
+        llm_requests, endpoint_requests = llm.requests, endpoint.requests
+
+    print(f"database={args.database} generator={args.generator} questions={len(questions)} workers={args.workers}")
+    print(f"{'stage':<18}{'seconds':>9}{'q/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'max ms':>9}{'errors':>8}")
+    for row in rows:
+        latencies = "".join(f"{row[key] * 1000:>9.1f}" if key in row else f"{'-':>9}" for key in ("p50", "p95", "max"))
+        print(f"{row['stage']:<18}{row['seconds']:>9.2f}{row['throughput']:>9.1f}{latencies}{row.get('errors', 0):>8}")
+    print(f"overall_average_jaccard_score {scores['overall_average_jaccard_score']:.4f}; "
+          f"stub LLM requests {llm_requests}, stub endpoint requests {endpoint_requests}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(
+                {
+                    "database": args.database,
+                    "generator": args.generator,
+                    "questions": len(questions),
+                    "workers": args.workers,
+                    "stages": rows,
+                    "overall_average_jaccard_score": scores["overall_average_jaccard_score"],
+                },
+                f,
+                indent=2,
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""
+End-to-end latency of the single-question service (functions.sparql_service) with a stub LLM
+and a stub SPARQL endpoint; rdf-config runs locally. Latency is measured on the client side.
+Exits with status 1 when a request fails or p95 is over target.
+
+    python -m benchmarks.bench_service --database rhea --requests 200 --concurrency 8 --llm-latency 0.2
+"""
+from concurrent.futures import ThreadPoolExecutor
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+import numpy as np
+import requests
+
+from benchmarks.stubs import REPO_DIR, StubLLMServer, StubSparqlEndpoint, configure_stub_environment
+
+
+def make_workload(database, n_requests, repeat_fraction, seed=0):
+    with open(os.path.join(REPO_DIR, "questions", "json_format", f"{database}.json"), "r") as f:
+        questions = [q["user_question"] for q in json.load(f)]
+    rng = random.Random(seed)
+    workload = []
+    for _ in range(n_requests):
+        if workload and rng.random() < repeat_fraction:
+            workload.append(rng.choice(workload))
+        else:
+            workload.append(rng.choice(questions))
+    return workload
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database", default="rhea", choices=["rhea", "uniprot", "bgee"])
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--repeat-fraction", type=float, default=0.3, help="share of requests repeating an earlier question")
+    parser.add_argument("--llm-latency", type=float, default=0.2, help="stub LLM response time [s]")
+    parser.add_argument("--endpoint-latency", type=float, default=0.05, help="stub endpoint response time [s]")
+    parser.add_argument("--execute", action="store_true", help="also execute the generated query")
+    parser.add_argument("--no-server", action="store_true", help="run rdf-config once per request instead of the server")
+    parser.add_argument("--p95-target", type=float, default=0.5, help="p95 latency target [s]")
+    args = parser.parse_args()
+
+    with StubLLMServer(args.llm_latency) as llm, StubSparqlEndpoint(latency=args.endpoint_latency) as endpoint:
+        configure_stub_environment(llm, endpoint, [args.database])
+        from functions.sparql_service import SparqlService, serve
+
+        started = time.perf_counter()
+        service = SparqlService([args.database], args.concurrency, use_server=not args.no_server).warm()
+        warm_seconds = time.perf_counter() - started
+        server = serve(service, port=0)
+        url = f"http://127.0.0.1:{server.server_port}/sparql"
+        session = requests.Session()
+        session.mount("http://", requests.adapters.HTTPAdapter(pool_maxsize=args.concurrency))
+
+        def call(question):
+            started = time.perf_counter()
+            response = session.post(url, json={"database": args.database, "question": question, "execute": args.execute})
+            return response.status_code, response.json(), time.perf_counter() - started
+
+        workload = make_workload(args.database, args.requests, args.repeat_fraction)
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+            responses = list(executor.map(call, workload))
+        wall = time.perf_counter() - started
+        server.shutdown()
+        service.close()
+
+    ok = [body for status, body, _ in responses if status == 200]
+    errors = len(responses) - len(ok)
+    request_ids = {body["request_id"] for body in ok}
+    print(f"warm-up {warm_seconds:.2f}s; {len(workload)} requests, concurrency {args.concurrency}, "
+          f"stub LLM {args.llm_latency * 1000:.0f} ms")
+    print(f"ok {len(ok)}  errors {errors}  memo hits {sum(body['cached'] for body in ok)}  "
+          f"LLM calls {llm.requests}  distinct request ids {len(request_ids)}")
+    if not ok:
+        print("every request failed")
+        sys.exit(1)
+    latencies = np.array([seconds for status, _, seconds in responses if status == 200])
+    p50, p95 = np.percentile(latencies, [50, 95])
+    print(f"latency p50 {p50 * 1000:.1f} ms  p95 {p95 * 1000:.1f} ms  max {latencies.max() * 1000:.1f} ms")
+    print(f"throughput {len(workload) / wall:.1f} requests/s")
+    if errors:
+        print(f"{errors} requests failed")
+        sys.exit(1)
+    if p95 > args.p95_target:
+        print(f"p95 is over the target of {args.p95_target * 1000:.0f} ms")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,260 @@
+"""
+Local stand-ins for the OpenAI API and a SPARQL endpoint, so the pipeline can be timed without network access.
+
+StubLLMServer answers /v1/chat/completions with recorded outputs: prompts from make_prompt /
+make_one_prompt get the variables / conditions answer built from the question's gold
+"variables" and "param" (questions/json_format), and fine-tuned style requests (system prompt
++ user question) get the assistant SPARQL from dataset_for_finetuning/*.jsonl.
+StubSparqlEndpoint answers SPARQL protocol GET / POST requests with results from a callable:
+recorded results (questions saved with "results", looked up by normalized query text) or
+deterministic synthetic results derived from the query text.
+"""
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import glob
+import hashlib
+import json
+import os
+import random
+import re
+import threading
+import time
+import urllib.parse
+
+from functions.query_cache import normalize_query_text
+from functions.SPARQL_executer import prepare_query_text
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def propose_output(question):
+    """
+    The answer the prompts ask for, built from the gold variables and conditions of a question.
+    """
+    lines = [
+        "1. Variables",
+        "variables to look for based on elements in [variables_info]:",
+        *[f"- {variable}" for variable in question["variables"]],
+        "",
+        "2. Conditions",
+        "condition and variable (If it's a name, use a full name with underscore URI and prefix res:) pair:",
+    ]
+    if question["param"]:
+        lines.append("- {" + ", ".join(question["param"]) + "}")
+    return "\n".join(lines) + "\n"
+
+
+def load_recorded_outputs(repo_dir=REPO_DIR):
+    """
+    Return {user question: output} for both prompt styles, from the question and fine-tuning datasets.
+    """
+    outputs = {"propose": {}, "sparql": {}}
+    for path in sorted(glob.glob(os.path.join(repo_dir, "questions", "json_format", "*.json"))):
+        with open(path, "r") as f:
+            for question in json.load(f):
+                outputs["propose"].setdefault(question["user_question"].strip(), propose_output(question))
+    for path in sorted(glob.glob(os.path.join(repo_dir, "dataset_for_finetuning", "*.jsonl"))):
+        with open(path, "r") as f:
+            for line in f:
+                messages = json.loads(line)["messages"]
+                user = next(m["content"] for m in messages if m["role"] == "user")
+                assistant = next(m["content"] for m in messages if m["role"] == "assistant")
+                outputs["sparql"].setdefault(user.strip(), assistant)
+    return outputs
+
+
+class _Server:
+    def start(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), self._make_handler())
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    @property
+    def port(self):
+        return self.server.server_port
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _send(handler, status, content_type, data):
+    handler.send_response(status)
+    handler.send_header("Content-Type", content_type)
+    handler.send_header("Content-Length", str(len(data)))
+    handler.end_headers()
+    handler.wfile.write(data)
+
+
+class StubLLMServer(_Server):
+    """
+    OpenAI-compatible chat completions server replaying recorded outputs after `latency` seconds.
+    """
+
+    def __init__(self, latency=0.0, outputs=None, default_output=None):
+        self.latency = latency
+        self.outputs = outputs or load_recorded_outputs()
+        self.default_output = default_output or next(iter(self.outputs["propose"].values()))
+        self.requests = 0
+        self._lock = threading.Lock()
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.port}/v1"
+
+    def reply(self, messages):
+        content = messages[-1]["content"]
+        if any(m["role"] == "system" for m in messages):
+            return self.outputs["sparql"].get(content.strip(), self.default_output)
+        # make_prompt のプロンプトは最後の "User Question:" 行に質問がある
+        match = re.search(r"User Question:(.*?)\n\[OUTPUT\]", content, re.DOTALL)
+        question = match.group(1).strip() if match else content.strip()
+        return self.outputs["propose"].get(question, self.default_output)
+
+    def _make_handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                with stub._lock:
+                    stub.requests += 1
+                if stub.latency:
+                    time.sleep(stub.latency)
+                output = stub.reply(body["messages"])
+                prompt_tokens = sum(len(m["content"]) for m in body["messages"]) // 4
+                data = json.dumps(
+                    {
+                        "id": f"stub-{stub.requests}",
+                        "object": "chat.completion",
+                        "created": int(time.time()),
+                        "model": body["model"],
+                        "choices": [
+                            {"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": output}}
+                        ],
+                        "usage": {
+                            "prompt_tokens": prompt_tokens,
+                            "completion_tokens": len(output) // 4,
+                            "total_tokens": prompt_tokens + len(output) // 4,
+                        },
+                    }
+                ).encode()
+                _send(self, 200, "application/json", data)
+
+        return Handler
+
+
+def constant_results(rows=10, variables=("value",)):
+    bindings = [{var: {"type": "literal", "value": f"{var}-{i}"} for var in variables} for i in range(rows)]
+    return lambda query: bindings
+
+
+def synthetic_results(rows=20, distinct=40):
+    """
+    Deterministic results for any query: the SELECT variables, with values drawn (seeded by the
+    normalized query text) from a small shared vocabulary so different queries overlap.
+    """
+
+    def results(query):
+        text = normalize_query_text(query)
+        match = re.search(r"SELECT\s+(?:DISTINCT\s+)?(.*?)\s+WHERE", text, re.IGNORECASE | re.DOTALL)
+        variables = re.findall(r"\?(\w+)", match.group(1)) if match else []
+        variables = list(dict.fromkeys(variables)) or ["value"]
+        seed = int.from_bytes(hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest(), "little")
+        rng = random.Random(seed)
+        return [
+            {var: {"type": "literal", "value": f"v{rng.randrange(distinct)}"} for var in variables}
+            for _ in range(rng.randint(1, rows))
+        ]
+
+    return results
+
+
+def recorded_results(questions, sparql_key_name="sparql", limit_number=10000, prefix="", fallback=None):
+    """
+    Results recorded in questions (each with "results" and the query under sparql_key_name),
+    looked up by the normalized text execute_query sends; other queries go to fallback.
+    """
+    recorded = {}
+    for question in questions:
+        if question.get("results") is not None and question.get(sparql_key_name):
+            query_text = prepare_query_text(question, sparql_key_name, limit_number, prefix)
+            recorded[normalize_query_text(query_text)] = question["results"]
+    fallback = fallback or synthetic_results()
+    return lambda query: recorded.get(normalize_query_text(query)) or fallback(query)
+
+
+class StubSparqlEndpoint(_Server):
+    """
+    SPARQL endpoint answering every query with results(query) (a list of bindings) after `latency` seconds.
+    """
+
+    def __init__(self, results=None, latency=0.0):
+        self.results = results or constant_results()
+        self.latency = latency
+        self.requests = 0
+        self._lock = threading.Lock()
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.port}/sparql"
+
+    def _make_handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def respond(self, query):
+                with stub._lock:
+                    stub.requests += 1
+                if stub.latency:
+                    time.sleep(stub.latency)
+                bindings = stub.results(query)
+                variables = list(dict.fromkeys(var for row in bindings for var in row))
+                data = json.dumps({"head": {"vars": variables}, "results": {"bindings": bindings}}).encode()
+                _send(self, 200, "application/sparql-results+json", data)
+
+            def do_GET(self):
+                params = urllib.parse.parse_qs(urllib.parse.urlparse(self.path).query)
+                self.respond(params.get("query", [""])[0])
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0))).decode("utf-8")
+                if self.headers.get("Content-Type", "").startswith("application/sparql-query"):
+                    self.respond(body)
+                else:
+                    self.respond(urllib.parse.parse_qs(body).get("query", [""])[0])
+
+        return Handler
+
+
+def configure_stub_environment(llm, endpoint, databases):
+    """
+    Point the OpenAI client and the database endpoints at the stubs and turn off the disk caches,
+    so every run measures the same work.
+    """
+    os.environ["OPENAI_BASE_URL"] = llm.base_url
+    os.environ["OPENAI_API_KEY"] = "stub"
+    for database in databases:
+        os.environ[f"ENDPOINT_{database.upper()}"] = endpoint.url
+    os.environ.setdefault("PATH_DIR", REPO_DIR + "/")
+    os.environ.setdefault("PATH_PROMPTS", "data/prompt/prompts.json")
+    os.environ.setdefault("PATH_VARIABLES", "data/prompt/variables.json")
+    os.environ.setdefault("PATH_RDF_CONFIG", os.path.join(REPO_DIR, "rdf-config") + "/")
+    for name in ("LLM_CACHE_DIR", "QUERY_CACHE_DIR", "SCORE_CACHE_DIR", "TRACE_PATH"):
+        os.environ[name] = ""
@@ -1,7 +1,20 @@
-from SPARQLWrapper import JSON, SPARQLWrapper
-from multiprocessing import Process, Queue
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from requests.adapters import HTTPAdapter
 
+import json
+import os
 import re
+import requests
+import socket
+import threading
+import time
+
+from .local_store import get_local_store, is_local_endpoint
+from .query_cache import get_default_query_cache
+from .result_store import decode_chunks, parse_json_stream, parse_tsv_stream, spill_path
+from .tracing import trace_add, trace_context, trace_set, trace_span
 
 def replace_comma_in_res(text):
     def replace_match(match):
@@ -10,67 +23,399 @@ def replace_comma_in_res(text):
     pattern = r'(res:)([^,\s]*(?:,[^,\s]*)*)'
     return re.sub(pattern, replace_match, text)
 
-def execute_one_query(query, endpoint):
-    sparql = SPARQLWrapper(endpoint)
-    sparql.setQuery(query)
-    sparql.setReturnFormat(JSON)
-    sparql.setTimeout(10 * 60)
-    results = sparql.query().convert()
-    return results["results"]["bindings"]
+class QueryError(Exception):
+    """
+    A failed query execution. error_type is "syntax", "timeout", "http" or "error".
+    """
+
+    def __init__(self, error_type, message, http_status=None):
+        super().__init__(message)
+        self.error_type = error_type
+        self.http_status = http_status
+
+
+# エンドポイントのエラーメッセージ (Virtuoso / QLever / Jena) から種類を判定する
+_TIMEOUT_PATTERN = re.compile(r"time ?out|timed out|SR171|estimated execution time", re.IGNORECASE)
+_SYNTAX_PATTERN = re.compile(r"syntax|parse error|SP030|malformed query|invalid sparql|lexical error", re.IGNORECASE)
+CONNECT_TIMEOUT = 10
+
+
+def classify_http_error(http_status, body):
+    if http_status in (408, 504) or _TIMEOUT_PATTERN.search(body):
+        return "timeout"
+    if http_status == 400 or _SYNTAX_PATTERN.search(body):
+        return "syntax"
+    return "http"
+
+
+def default_timeout():
+    """
+    Hard deadline in seconds for one query (QUERY_TIMEOUT, default 10 minutes).
+    """
+    return float(os.environ.get("QUERY_TIMEOUT") or 10 * 60)
 
 
-def execute_query(question, endpoint, sparql_key_name, limit_number, prefix):
+def _abort(response, aborted):
+    aborted.set()
+    # close() だけでは別スレッドの recv が戻らないので、ソケットを shutdown する
+    sock = getattr(getattr(response.raw, "_connection", None), "sock", None)
+    if sock is not None:
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+    response.close()
+
+
+# このスレッドで最後に受け取った HTTP ステータス (execute_queries の記録用)
+_last_response = threading.local()
+
+
+@contextmanager
+def _request(query_text, endpoint, accept, timeout):
+    """
+    POST query_text and yield the streaming response. The whole exchange, including reading the
+    body inside the with block, is cancelled after timeout seconds by closing the connection.
+    Every failure is raised as a QueryError.
+    """
+    deadline = time.monotonic() + timeout
     try:
-        # 特定の質問からSPARQLクエリを取得
-        sparql = SPARQLWrapper(endpoint) 
+        response = get_session().post(
+            endpoint,
+            data={"query": query_text},
+            headers={"Accept": accept},
+            timeout=(min(CONNECT_TIMEOUT, timeout), timeout),
+            stream=True,
+        )
+    except requests.Timeout as e:
+        raise QueryError("timeout", f"Query timed out after {timeout:g} s: {e}") from e
+    except requests.RequestException as e:
+        raise QueryError("http", str(e)) from e
 
-        query_text = prefix + question[sparql_key_name]
+    aborted = threading.Event()
+    timer = threading.Timer(max(deadline - time.monotonic(), 0), _abort, (response, aborted))
+    timer.daemon = True
+    timer.start()
+    try:
+        trace_set(http_status=response.status_code)
+        _last_response.http_status = response.status_code
+        if response.status_code >= 400:
+            body = response.content
+            trace_add("bytes", len(body))
+            message = body.decode(response.encoding or "utf-8", errors="replace").strip()
+            raise QueryError(
+                classify_http_error(response.status_code, message),
+                f"HTTP {response.status_code} {response.reason}: {message[:2000]}",
+                response.status_code,
+            )
+        yield response
+    except QueryError as e:
+        if aborted.is_set():
+            raise QueryError("timeout", f"Query cancelled after {timeout:g} s", e.http_status) from e
+        raise
+    except Exception as e:
+        if aborted.is_set() or isinstance(e, requests.Timeout):
+            raise QueryError("timeout", f"Query cancelled after {timeout:g} s", response.status_code) from e
+        raise QueryError("error", f"{type(e).__name__}: {e}", response.status_code) from e
+    finally:
+        timer.cancel()
+        response.close()
 
-        query_text = query_text.replace("LIMIT", "#LIMIT")
-        if limit_number >= 1:
-            query_text = query_text + "\nLIMIT " + str(limit_number)
 
-        query_text = replace_comma_in_res(query_text)
+def run_query(query_text, endpoint, timeout=None):
+    """
+    Execute query_text once within the hard deadline and return its bindings, or raise QueryError.
+    A "local:PATH" endpoint runs the query on the snapshot at PATH (functions.local_store).
+    """
+    if is_local_endpoint(endpoint):
+        return query_local(query_text, endpoint)["results"]["bindings"]
+    return post_query(query_text, endpoint, timeout)["results"]["bindings"]
 
-        # コメントを削除
-        query_text = re.sub(r'(?m)^#.*$', '', query_text)
 
-        sparql.setQuery(query_text)
-        sparql.setReturnFormat(JSON)
-        sparql.setTimeout(10 * 60)
-        results = sparql.query().convert()
+def query_local(query_text, endpoint):
+    """
+    Run query_text on the local snapshot of endpoint and return the SPARQL JSON results.
+    rdflib cannot interrupt a running query, so the hard deadline does not apply here.
+    """
+    from pyparsing import ParseException
 
-       
-        return results["results"]["bindings"], question["id"]
+    try:
+        results = get_local_store(endpoint).query(query_text)
+    except ParseException as e:
+        raise QueryError("syntax", f"{type(e).__name__}: {e}") from e
+    except Exception as e:
+        raise QueryError("error", f"{type(e).__name__}: {e}") from e
+    trace_set(backend="local")
+    return results
+
+
+# 直近に実行したクエリの結果 (None) またはエラーメッセージ。execute_query_for_error が再実行せずに使う
+_recent_errors = OrderedDict()
+_recent_errors_lock = threading.Lock()
+RECENT_ERRORS_SIZE = 4096
+
+
+def _remember_outcome(endpoint, query_text, error):
+    with _recent_errors_lock:
+        _recent_errors[(endpoint, query_text)] = error
+        _recent_errors.move_to_end((endpoint, query_text))
+        if len(_recent_errors) > RECENT_ERRORS_SIZE:
+            _recent_errors.popitem(last=False)
+
+
+def _cached(query_text, endpoint, cache, call):
+    def traced_call():
+        trace_set(cache_hit=False)
+        return call()
+
+    # cache が None なら QUERY_CACHE_DIR の設定を使う (未設定ならキャッシュしない)
+    if cache is None:
+        cache = get_default_query_cache()
+    with trace_span("query", endpoint=endpoint, cache_hit=True) as span:
+        try:
+            if cache is None:
+                results = traced_call()
+            else:
+                results = cache.get_or_call(endpoint, query_text, traced_call)
+        except Exception as e:
+            span.set(error_type=getattr(e, "error_type", "error"))
+            _remember_outcome(endpoint, query_text, str(e))
+            raise
+        _remember_outcome(endpoint, query_text, None)
+        span.set(rows=len(results))
+        return results
+
+
+def execute_one_query(query, endpoint, cache=None, timeout=None, limit_number=10000, prefix=""):
+    """
+    Execute query and return its bindings. The query goes through the same LIMIT rewrite and
+    comment stripping as execute_query (prepare_query_text), so both share cache entries.
+    """
+    query_text = prepare_query_text({"query": query}, "query", limit_number, prefix)
+    return _cached(query_text, endpoint, cache, lambda: run_query(query_text, endpoint, timeout))
+
+
+def execute_query(question, endpoint, sparql_key_name, limit_number, prefix, cache=None, timeout=None):
+    try:
+        # 特定の質問からSPARQLクエリを取得
+        query_text = prepare_query_text(question, sparql_key_name, limit_number, prefix)
+
+        with trace_context(question_id=question["id"]):
+            results = _cached(query_text, endpoint, cache, lambda: run_query(query_text, endpoint, timeout))
+
+        return results, question["id"]
     except Exception as e:
         print(f"Execute Error: {e}")
         print(question["id"])
         return [], question
 
 
-def execute_query_for_error(question, endpoint, sparql_key_name, limit_number, prefix):
-    timeout_seconds = 600  # タイムアウト時間を設定
-    try:
-        # SPARQLクエリを準備
-        sparql = SPARQLWrapper(endpoint)
+def execute_query_for_error(question, endpoint, sparql_key_name, limit_number, prefix, cache=None, timeout=None):
+    """
+    Return "no error" or the error message of the question's query. The outcome of the last
+    execute_query / execute_queries run of the same query is reused instead of running it again.
+    """
+    query_text = prepare_query_text(question, sparql_key_name, limit_number, prefix)
+    with _recent_errors_lock:
+        known = (endpoint, query_text) in _recent_errors
+        error = _recent_errors.get((endpoint, query_text))
+    if not known:
+        try:
+            with trace_context(question_id=question["id"]):
+                _cached(query_text, endpoint, cache, lambda: run_query(query_text, endpoint, timeout))
+        except Exception as e:
+            # エラー内容を返す
+            error = str(e)
+    return error or "no error"
 
-        query_text = prefix + question[sparql_key_name]
 
-        query_text = query_text.replace("LIMIT", "#LIMIT")
-        if limit_number >= 1:
-            query_text += "\nLIMIT " + str(limit_number)
+def prepare_query_text(question, sparql_key_name, limit_number, prefix):
+    """
+    Build the query text sent to the endpoint, the same way execute_query does.
+    """
+    query_text = prefix + question[sparql_key_name]
 
-        query_text = replace_comma_in_res(query_text)
+    query_text = query_text.replace("LIMIT", "#LIMIT")
+    if limit_number >= 1:
+        query_text = query_text + "\nLIMIT " + str(limit_number)
 
-        # コメントを削除
-        query_text = re.sub(r'(?m)^#.*$', '', query_text)
+    query_text = replace_comma_in_res(query_text)
 
-        sparql.setQuery(query_text)
-        sparql.setReturnFormat(JSON)
-        sparql.setTimeout(10 * 60)
+    # コメントを削除
+    query_text = re.sub(r'(?m)^#.*$', '', query_text)
+    return query_text
 
-        results = sparql.query().convert()
-        return "no error"
-    except Exception as e:
-        # エラー内容を返す
-        return str(e)
+
+_session = None
+_endpoint_semaphores = {}
+_session_lock = threading.Lock()
+
+
+def get_session(pool_size=32):
+    """
+    Return the shared requests.Session; its connection pool keeps HTTP connections alive between queries.
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=8, pool_maxsize=pool_size)
+            _session.mount("http://", adapter)
+            _session.mount("https://", adapter)
+        return _session
+
+
+def get_endpoint_semaphore(endpoint, max_in_flight):
+    """
+    Return the semaphore shared by every call that sends queries to endpoint. The limit is
+    fixed by the first call for the endpoint; later calls with another max_in_flight share it.
+    """
+    with _session_lock:
+        semaphore = _endpoint_semaphores.get(endpoint)
+        if semaphore is None:
+            semaphore = threading.BoundedSemaphore(max_in_flight)
+            _endpoint_semaphores[endpoint] = semaphore
+        return semaphore
+
+
+def post_query(query_text, endpoint, timeout=None):
+    """
+    Send query_text to endpoint with the SPARQL protocol over the shared session and return the parsed JSON.
+    The request is cancelled after timeout seconds (default_timeout()); failures raise QueryError.
+    """
+    with _request(query_text, endpoint, "application/sparql-results+json", timeout or default_timeout()) as response:
+        body = b"".join(_count_bytes(response.iter_content(chunk_size=64 * 1024)))
+        return json.loads(body)
+
+
+def stream_query(query_text, endpoint, timeout=None, result_format="json"):
+    """
+    Send query_text to endpoint and parse the response incrementally into a ColumnarResult.
+
+    result_format is "json" (application/sparql-results+json) or "tsv" (text/tab-separated-values).
+    The request is cancelled after timeout seconds (default_timeout()); failures raise QueryError.
+    """
+    if is_local_endpoint(endpoint):
+        return parse_json_stream([json.dumps(query_local(query_text, endpoint))])
+    accept = "text/tab-separated-values" if result_format == "tsv" else "application/sparql-results+json"
+    with _request(query_text, endpoint, accept, timeout or default_timeout()) as response:
+        chunks = decode_chunks(_count_bytes(response.iter_content(chunk_size=64 * 1024)), response.encoding or "utf-8")
+        if result_format == "tsv":
+            return parse_tsv_stream(_iter_lines(chunks))
+        return parse_json_stream(chunks)
+
+
+def _count_bytes(byte_chunks):
+    for chunk in byte_chunks:
+        trace_add("bytes", len(chunk))
+        yield chunk
+
+
+def _iter_lines(chunks):
+    pending = ""
+    for chunk in chunks:
+        pending += chunk
+        *lines, pending = pending.split("\n")
+        yield from lines
+    if pending:
+        yield pending
+
+
+def execute_queries(
+    questions,
+    endpoint,
+    sparql_key_name,
+    limit_number,
+    prefix,
+    max_workers=8,
+    max_in_flight=4,
+    timeout=None,
+    cache=None,
+    spill_dir=None,
+    result_format="json",
+):
+    """
+    Execute the queries of all questions against endpoint in parallel and set question["results"].
+
+    At most max_in_flight requests are sent to the same endpoint at once, counted across all calls
+    (the limit of the first call for the endpoint applies). Returns one record
+    per question, in input order, with id, status ("ok" / "error"), error_type ("empty" for an
+    ok query without rows; "syntax" / "timeout" / "http" / "error" for a failed one), http_status
+    (None when no HTTP request was made: a cache hit or a local: endpoint), latency, row count
+    and error message. Each query is sent once and cancelled after timeout
+    seconds (default_timeout()). Queries found in cache (or the QUERY_CACHE_DIR cache)
+    are not sent to the endpoint.
+
+    With spill_dir set, responses are parsed as they stream in ("json" or "tsv" result_format)
+    and written to spill_dir/{id}.json as columnar data; question["results_path"] is set instead
+    of question["results"], so only the result sets in flight are held in memory. This mode
+    bypasses the result cache (cache / QUERY_CACHE_DIR): every query is sent to the endpoint,
+    since a cached result would have to be loaded into memory as bindings.
+    """
+    semaphore = get_endpoint_semaphore(endpoint, max_in_flight)
+
+    def fetch(query_text):
+        with semaphore:
+            return run_query(query_text, endpoint, timeout)
+
+    def run(question):
+        with trace_context(question_id=question["id"]):
+            return run_traced(question)
+
+    def run_traced(question):
+        record = {
+            "id": question["id"],
+            "status": "ok",
+            "error_type": None,
+            "http_status": None,
+            "latency": 0.0,
+            "rows": 0,
+            "error": None,
+        }
+        # キャッシュや local: で HTTP リクエストを送らなかった場合は None のまま
+        _last_response.http_status = None
+        try:
+            query_text = prepare_query_text(question, sparql_key_name, limit_number, prefix)
+            started = time.perf_counter()
+            try:
+                if spill_dir is not None:
+                    with semaphore, trace_span("query", endpoint=endpoint) as span:
+                        try:
+                            result = stream_query(query_text, endpoint, timeout, result_format)
+                        except Exception as e:
+                            span.set(error_type=getattr(e, "error_type", "error"))
+                            _remember_outcome(endpoint, query_text, str(e))
+                            raise
+                        _remember_outcome(endpoint, query_text, None)
+                        span.set(rows=len(result))
+                    path = spill_path(spill_dir, question["id"])
+                    result.save(path)
+                    question.pop("results", None)
+                    question["results_path"] = path
+                    record["http_status"] = _last_response.http_status
+                    record["rows"] = len(result)
+                    record["error_type"] = None if len(result) else "empty"
+                    return record
+                bindings = _cached(query_text, endpoint, cache, lambda: fetch(query_text))
+            finally:
+                record["latency"] = time.perf_counter() - started
+            record["http_status"] = _last_response.http_status
+        except Exception as e:
+            print(f"Execute Error: {e}")
+            print(question["id"])
+            record["http_status"] = getattr(e, "http_status", None)
+            record["status"] = "error"
+            record["error_type"] = getattr(e, "error_type", "error")
+            record["error"] = str(e)
+            bindings = []
+
+        question["results"] = bindings
+        record["rows"] = len(bindings)
+        if record["status"] == "ok" and not bindings:
+            record["error_type"] = "empty"
+        return record
+
+    if spill_dir is not None:
+        os.makedirs(spill_dir, exist_ok=True)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(run, questions))
@@ -1,8 +1,11 @@
 from .gpt_excute import excute_gpt
-from .rdf_config_executer import create_strain_text, execute_rdf_config
+from .rdf_config_executer import compile_sparql
+from .schema_validator import SchemaError, check_spec, repair_hint
 from .text_extractor import extract_conditions_variables, extract_variable_names
-import os
+from .tracing import trace_add, trace_set, trace_span
+from concurrent.futures import ThreadPoolExecutor
 import re
+import uuid
 
 def remove_specific_word_v2(query: str, word_to_remove: str) -> str:
     # SELECT と WHERE の間を正規表現で抽出
@@ -25,96 +28,45 @@ def remove_specific_word_v2(query: str, word_to_remove: str) -> str:
         return query
     
 
-def sparql_gen(database: str, questions: list, verbose: bool = False):
+def generate_sparql_for_question(
+    database: str,
+    question: dict,
+    verbose: bool = False,
+    max_retry: int = 3,
+    use_server: bool = True,
+    llm_output: str = None,
+):
     """
-    Generate and execute SPARQL queries for a list of questions using GPT-4, and update each question with the results.
-    """
-    for question in questions:
-        # Generate SPARQL queries using GPT-4 based on the filled prompt
-        retry = 0
-        max_retry = 3
-        while retry < max_retry:
-            try:
-                llm_output = excute_gpt(question["prompt_filled"])
-
-                # Extract variables and parameters from the GPT output
-                variables = extract_variable_names(llm_output)
-                if variables == []:
-                    raise Exception("No variables found in the GPT output", variables)
-                
-                parameters = extract_conditions_variables(llm_output)
-                if parameters == {}: 
-                    raise Exception("No parameters found in the GPT output", parameters)
-
-                if verbose:
-                    print("###"*100)
-                    print(f"llm_output: {llm_output}")
-                    print("---"*10)
-                    print(f"Variables: {variables}")
-                    print("---"*10)
-                    print(f"Parameters: {parameters}")
-
-                # Create strain text and execute RDF configuration
-                create_strain_text(database, question["id"], variables, parameters)
-                rdf_result = execute_rdf_config(database, question["id"])
-
-                for key in parameters.keys():
-                    rdf_result = remove_specific_word_v2(rdf_result, "?"+key)
-            
-                # Update each question dictionary with the results
-                question.update(
-                    {
-                        "llm_output": llm_output,
-                        "llm_variable": variables,
-                        "llm_parameter": parameters,
-                        "llm_rdf_result": rdf_result,
-                    }
-                )
-
-                break
-            except Exception as e:
-                print(f"Error: {e}")
-                print(question["id"])
-
-                # load os.environ["PATH_RDF_CONFIG"] + "config/" + database + "/sparql.yaml"
-                path_config_sparql = os.environ["PATH_RDF_CONFIG"] + "config/" + database + "/sparql.yaml"
-                with open(path_config_sparql, "r") as file:
-                    config_sparql = file.read()
-                
-                print(f"Remove {question['id']} from {path_config_sparql}")
-                if str(question["id"])+":" in config_sparql:
-                    # remove after ID{question["id"]}
-                    config_sparql = config_sparql.split(str(question["id"]))[0]
-                    with open(path_config_sparql, "w") as file:
-                        file.write(config_sparql)
-                    print(f"{question['id']} removed from {path_config_sparql}")
-                retry += 1
+    Generate a SPARQL query for one question, retrying up to max_retry times, and update the question in place.
 
-
-    # Since questions list is modified in place, return is not necessary unless needed for chaining or similar uses
-    return questions
+    llm_output, if given (e.g. from a batch job), is used as the first attempt's LLM output.
+    """
+    with trace_span("sparql_gen", question_id=question["id"]):
+        return _generate_sparql_for_question(database, question, verbose, max_retry, use_server, llm_output)
 
 
-def generate_one_sparql(database: str, user_question: str, verbose: bool = False):
-    """
-    Generate and execute SPARQL queries for a list of questions using GPT-4, and update each question with the results.
-    """
-    # Generate SPARQL queries using GPT-4 based on the filled prompt
+def _generate_sparql_for_question(database, question, verbose, max_retry, use_server, first_output=None):
     retry = 0
-    max_retry = 3
+    hint = ""
     while retry < max_retry:
         try:
-            llm_output = excute_gpt(user_question)
+            if retry == 0 and first_output is not None:
+                llm_output = first_output
+            else:
+                llm_output = excute_gpt(question["prompt_filled"] + hint)
 
             # Extract variables and parameters from the GPT output
             variables = extract_variable_names(llm_output)
             if variables == []:
                 raise Exception("No variables found in the GPT output", variables)
-            
+
             parameters = extract_conditions_variables(llm_output)
-            if parameters == {}: 
+            if parameters == {}:
                 raise Exception("No parameters found in the GPT output", parameters)
 
+            # rdf-config を呼ぶ前にモデルと照合する
+            check_spec(database, variables, parameters)
+
             if verbose:
                 print("###"*100)
                 print(f"llm_output: {llm_output}")
@@ -123,17 +75,88 @@ def generate_one_sparql(database: str, user_question: str, verbose: bool = False
                 print("---"*10)
                 print(f"Parameters: {parameters}")
 
-            # Create strain text and execute RDF configuration
-            create_strain_text(database, "SPARQL-test", variables, parameters)
-            rdf_result = execute_rdf_config(database, "SPARQL-test")
+            # Compile the spec with rdf-config (sparql.yaml is not modified)
+            rdf_result = compile_sparql(database, question["id"], variables, parameters, use_server)
 
             for key in parameters.keys():
                 rdf_result = remove_specific_word_v2(rdf_result, "?"+key)
+
+            # Update each question dictionary with the results
+            question.update(
+                {
+                    "llm_output": llm_output,
+                    "llm_variable": variables,
+                    "llm_parameter": parameters,
+                    "llm_rdf_result": rdf_result,
+                }
+            )
+
             break
         except Exception as e:
             print(f"Error: {e}")
+            print(question["id"])
             retry += 1
+            if isinstance(e, SchemaError):
+                # 次の呼び出しに修正のヒントを付ける
+                hint = repair_hint(e.problems)
+                trace_add("schema_rejects")
+            trace_add("retries")
+            if retry >= max_retry:
+                trace_set(status="error", error=str(e))
+
+    return question
+
+
+def sparql_gen(
+    database: str,
+    questions: list,
+    verbose: bool = False,
+    max_workers: int = 1,
+    max_retry: int = 3,
+    use_server: bool = True,
+):
+    """
+    Generate and execute SPARQL queries for a list of questions using GPT-4, and update each question with the results.
 
+    With max_workers > 1 the questions are processed concurrently by a thread pool of that size,
+    and the returned list keeps the input order. Specs are compiled in memory by the rdf-config
+    server (use_server=True) or through a temporary config directory per question, so parallel
+    runs never share sparql.yaml.
+    """
+    if max_workers <= 1:
+        for question in questions:
+            generate_sparql_for_question(database, question, verbose, max_retry, use_server)
+    else:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            # map は入力順に結果を返す
+            list(
+                executor.map(
+                    lambda question: generate_sparql_for_question(database, question, verbose, max_retry, use_server),
+                    questions,
+                )
+            )
 
     # Since questions list is modified in place, return is not necessary unless needed for chaining or similar uses
-    return rdf_result
+    return questions
+
+
+def generate_one_sparql(
+    database: str,
+    user_question: str,
+    verbose: bool = False,
+    use_server: bool = True,
+    request_id: str = None,
+    max_retry: int = 3,
+):
+    """
+    Generate a SPARQL query for one filled prompt. Returns None when every retry fails.
+
+    The spec is compiled under request_id (a fresh "SPARQL-<uuid>" id by default), so concurrent
+    requests never share a query name.
+    """
+    if request_id is None:
+        request_id = f"SPARQL-{uuid.uuid4().hex[:12]}"
+    # sparql_gen と同じ処理 (再試行・モデルとの照合・トレース) を一時的な質問で行う
+    question = {"id": request_id, "prompt_filled": user_question}
+    generate_sparql_for_question(database, question, verbose, max_retry, use_server)
+    return question.get("llm_rdf_result")
@@ -0,0 +1,383 @@
+"""
+Batch mode for large sparql_gen sweeps: every prompt_filled request is written to one JSONL
+batch file (OpenAI Batch API format) and submitted as one job, which is polled until it ends.
+The outputs then go through variable / parameter extraction and rdf-config like sparql_gen.
+
+    python -m functions.batch_runner --sweep rhea:5:4 uniprot:2:2 bgee:6:5 --state data/batches/sweep.json
+    python -m functions.batch_runner --sweep rhea:5:4 --state /tmp/sweep.json --local   # no OpenAI Batch API
+
+The job ids and progress are kept in the state file, so an interrupted run resumes polling the
+same job (or downloading its output) instead of submitting it again. A job that ends failed,
+expired or cancelled is followed by a new job for the requests that have no output yet.
+"""
+from concurrent.futures import ThreadPoolExecutor
+import argparse
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+
+from .disk_cache import DiskCache
+from .gpt_excute import build_chat_request, create_chat_completion, get_client
+from .llm_cache import LLMCache, get_default_cache
+from .SPARQL_generator import generate_sparql_for_question
+from .tracing import trace_span
+
+BATCH_ENDPOINT = "/v1/chat/completions"
+TERMINAL_STATUSES = {"completed", "failed", "expired", "cancelled"}
+# この状態で終わったジョブは、出力のないリクエストだけで出し直す
+RESUBMIT_STATUSES = {"failed", "expired", "cancelled"}
+
+
+def batch_custom_id(database, question):
+    return f"{database}/{question['prompt_id']}/{question['prompt_variable_id']}/{question['id']}"
+
+
+def build_batch_requests(jobs, model_name=None, temperature=None):
+    """
+    One Batch API request per question of jobs ([(database, questions)] with prompt_filled from make_prompt).
+    """
+    requests = []
+    for database, questions in jobs:
+        for question in questions:
+            model, messages, params = build_chat_request(question["prompt_filled"], model_name, temperature)
+            requests.append(
+                {
+                    "custom_id": batch_custom_id(database, question),
+                    "method": "POST",
+                    "url": BATCH_ENDPOINT,
+                    "body": {"model": model, "messages": messages, **params},
+                }
+            )
+    return requests
+
+
+def write_jsonl(path, records):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "w") as f:
+        for record in records:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+
+def read_jsonl(path):
+    records = []
+    with open(path, "r") as f:
+        for line in f:
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError:
+                continue  # 書き込み途中で中断された行
+    return records
+
+
+def read_batch_outputs(path):
+    """
+    Return {custom_id: assistant message} for the successful lines of a batch output file.
+    """
+    outputs = {}
+    for record in read_jsonl(path):
+        response = record.get("response") or {}
+        if record.get("error") or response.get("status_code") != 200:
+            continue
+        outputs[record["custom_id"]] = response["body"]["choices"][0]["message"]["content"]
+    return outputs
+
+
+class OpenAIBatchProcessor:
+    """
+    Submits batch files to the OpenAI Batch API.
+    """
+
+    def __init__(self, client=None, completion_window="24h"):
+        self.client = client or get_client()
+        self.completion_window = completion_window
+
+    def submit(self, input_path):
+        with open(input_path, "rb") as f:
+            input_file = self.client.files.create(file=f, purpose="batch")
+        batch = self.client.batches.create(
+            input_file_id=input_file.id, endpoint=BATCH_ENDPOINT, completion_window=self.completion_window
+        )
+        return batch.id
+
+    def retrieve(self, batch_id):
+        batch = self.client.batches.retrieve(batch_id)
+        counts = batch.request_counts
+        return {
+            "status": batch.status,
+            "completed": counts.completed if counts else 0,
+            "failed": counts.failed if counts else 0,
+            "total": counts.total if counts else 0,
+        }
+
+    def download(self, batch_id, output_path):
+        batch = self.client.batches.retrieve(batch_id)
+        with open(output_path, "wb") as f:
+            # 失敗・期限切れのジョブでも、終わったリクエストの出力は取り出す
+            for file_id in (batch.output_file_id, batch.error_file_id):
+                if file_id:
+                    content = self.client.files.content(file_id).content
+                    f.write(content)
+                    if content and not content.endswith(b"\n"):
+                        f.write(b"\n")
+
+
+class LocalBatchProcessor:
+    """
+    Local stand-in for the Batch API: runs the requests of a batch file in a thread pool through
+    create_chat_completion (OPENAI_BASE_URL, e.g. the stub LLM in benchmarks.stubs).
+
+    Jobs live in directory as {id}.input.jsonl / {id}.output.jsonl; a job whose process died is
+    resumed from the lines already written when it is next retrieved.
+    """
+
+    def __init__(self, directory, max_workers=8):
+        self.directory = directory
+        self.max_workers = max_workers
+        self._threads = {}
+        self._lock = threading.Lock()
+
+    def _path(self, batch_id, kind):
+        return os.path.join(self.directory, f"{batch_id}.{kind}.jsonl")
+
+    def submit(self, input_path):
+        os.makedirs(self.directory, exist_ok=True)
+        batch_id = f"batch_local_{uuid.uuid4().hex[:12]}"
+        shutil.copyfile(input_path, self._path(batch_id, "input"))
+        open(self._path(batch_id, "output"), "a").close()
+        self._start(batch_id)
+        return batch_id
+
+    def _start(self, batch_id):
+        with self._lock:
+            thread = self._threads.get(batch_id)
+            if thread is None or not thread.is_alive():
+                thread = self._threads[batch_id] = threading.Thread(target=self._process, args=(batch_id,), daemon=True)
+                thread.start()
+
+    def _process(self, batch_id):
+        requests = read_jsonl(self._path(batch_id, "input"))
+        done = {record["custom_id"] for record in read_jsonl(self._path(batch_id, "output"))}
+        write_lock = threading.Lock()
+
+        def run(request):
+            body = dict(request["body"])
+            model, messages = body.pop("model"), body.pop("messages")
+            try:
+                completion = create_chat_completion(messages, model, body)
+                record = {
+                    "id": f"batch_req_{uuid.uuid4().hex[:12]}",
+                    "custom_id": request["custom_id"],
+                    "response": {"status_code": 200, "body": completion.model_dump()},
+                    "error": None,
+                }
+            except Exception as e:
+                record = {
+                    "id": f"batch_req_{uuid.uuid4().hex[:12]}",
+                    "custom_id": request["custom_id"],
+                    "response": None,
+                    "error": {"code": type(e).__name__, "message": str(e)},
+                }
+            with write_lock, open(self._path(batch_id, "output"), "a") as f:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            list(executor.map(run, [r for r in requests if r["custom_id"] not in done]))
+
+    def retrieve(self, batch_id):
+        total = len(read_jsonl(self._path(batch_id, "input")))
+        records = read_jsonl(self._path(batch_id, "output"))
+        failed = sum(1 for record in records if record.get("error"))
+        done = len({record["custom_id"] for record in records})
+        if done < total:
+            self._start(batch_id)
+        return {
+            "status": "completed" if done >= total else "in_progress",
+            "completed": done - failed,
+            "failed": failed,
+            "total": total,
+        }
+
+    def download(self, batch_id, output_path):
+        shutil.copyfile(self._path(batch_id, "output"), output_path)
+
+
+def _save_state(path, state):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(state, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def run_batch(requests, state_path, processor, poll_interval=30.0, max_resubmits=2):
+    """
+    Submit requests as one batch job (or resume the jobs recorded in state_path), wait for it
+    to end and return {custom_id: output}. A different set of requests starts over.
+
+    When a job ends failed / expired / cancelled, the requests without a successful output are
+    submitted again as a new job, at most max_resubmits times; the outputs of all jobs are merged.
+    """
+    base = os.path.splitext(state_path)[0]
+    requests_hash = DiskCache.hash_key(requests)
+
+    state = {}
+    if os.path.exists(state_path):
+        with open(state_path, "r") as f:
+            state = json.load(f)
+    if "batch_id" in state:
+        # ジョブを一つしか記録しない以前の形式
+        state = {
+            "requests_hash": state["requests_hash"],
+            "batches": [
+                {
+                    "batch_id": state["batch_id"],
+                    "status": state["status"],
+                    "requests": len(requests),
+                    "output_path": f"{base}.output.jsonl",
+                    "downloaded": state.get("downloaded", False),
+                }
+            ],
+        }
+    if state.get("requests_hash") != requests_hash:
+        state = {"requests_hash": requests_hash, "batches": []}
+
+    outputs = {}
+    for batch in state["batches"]:
+        if batch.get("downloaded"):
+            outputs.update(read_batch_outputs(batch["output_path"]))
+
+    while True:
+        batch = state["batches"][-1] if state["batches"] else None
+        if batch is None or batch.get("downloaded"):
+            missing = [request for request in requests if request["custom_id"] not in outputs]
+            if batch is not None and (
+                not missing or batch["status"] not in RESUBMIT_STATUSES or len(state["batches"]) > max_resubmits
+            ):
+                break
+            n = len(state["batches"])
+            input_path = f"{base}.{n}.input.jsonl"
+            write_jsonl(input_path, missing)
+            batch = {
+                "batch_id": processor.submit(input_path),
+                "status": "submitted",
+                "requests": len(missing),
+                "output_path": f"{base}.{n}.output.jsonl",
+            }
+            state["batches"].append(batch)
+            _save_state(state_path, state)
+            print(f"submitted batch {batch['batch_id']} with {len(missing)} requests")
+
+        with trace_span("batch", batch_id=batch["batch_id"], requests=batch["requests"]):
+            while batch["status"] not in TERMINAL_STATUSES:
+                progress = processor.retrieve(batch["batch_id"])
+                batch.update(progress)
+                _save_state(state_path, state)
+                print(f"batch {batch['batch_id']}: {progress['status']} {progress['completed']}/{progress['total']} "
+                      f"(failed {progress['failed']})")
+                if progress["status"] not in TERMINAL_STATUSES:
+                    time.sleep(poll_interval)
+
+            processor.download(batch["batch_id"], batch["output_path"])
+            batch["downloaded"] = True
+            _save_state(state_path, state)
+        outputs.update(read_batch_outputs(batch["output_path"]))
+
+    missing = len(requests) - sum(1 for request in requests if request["custom_id"] in outputs)
+    if missing:
+        print(f"warning: {missing} of {len(requests)} requests have no batch output "
+              f"(last batch {state['batches'][-1]['status']}); they fall back to synchronous calls")
+    return outputs
+
+
+def sparql_gen_batch(
+    jobs,
+    state_path,
+    processor=None,
+    poll_interval=30.0,
+    verbose=False,
+    max_workers=1,
+    max_retry=3,
+    use_server=True,
+    cache=None,
+):
+    """
+    sparql_gen for [(database, questions)] with the first LLM call of every question made through one batch job.
+
+    Outputs are stored in cache (or the LLM_CACHE_DIR cache) like excute_gpt's, then extracted and
+    compiled in place; questions without a batch output, or whose output is rejected, fall back to
+    synchronous calls (up to max_retry attempts in total).
+    """
+    requests = build_batch_requests(jobs)
+    outputs = run_batch(requests, state_path, processor or OpenAIBatchProcessor(), poll_interval)
+
+    if cache is None:
+        cache = get_default_cache()
+    if cache is not None:
+        for request in requests:
+            if request["custom_id"] in outputs:
+                body = dict(request["body"])
+                model, messages = body.pop("model"), body.pop("messages")
+                cache.put(LLMCache.make_key(model, messages, body), outputs[request["custom_id"]], model=model)
+
+    tasks = [(database, question) for database, questions in jobs for question in questions]
+
+    def generate(task):
+        database, question = task
+        output = outputs.get(batch_custom_id(database, question))
+        return generate_sparql_for_question(database, question, verbose, max_retry, use_server, output)
+
+    with ThreadPoolExecutor(max_workers=max(max_workers, 1)) as executor:
+        list(executor.map(generate, tasks))
+    return jobs
+
+
+def main():
+    from dotenv import load_dotenv
+
+    from .prompt_maker import make_prompt
+    from .rdf_config_executer import close_rdf_config_servers
+
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Batch-mode sparql_gen over database:prompt_id:prompt_variable_id combinations")
+    parser.add_argument("--sweep", nargs="+", required=True, help="database:prompt_id:prompt_variable_id")
+    parser.add_argument("--state", required=True, help="job state file; the batch input / output JSONL are written next to it")
+    parser.add_argument("--output-dir", default="data/questions", help="where to write {database}_{prompt_id}_{prompt_variable_id}_batch.json")
+    parser.add_argument("--local", action="store_true", help="process the batch file locally instead of with the OpenAI Batch API")
+    parser.add_argument("--local-workers", type=int, default=8)
+    parser.add_argument("--poll-interval", type=float, default=30.0)
+    parser.add_argument("--concurrency", type=int, default=4, help="concurrent extraction / rdf-config compilations")
+    parser.add_argument("--max-retry", type=int, default=3)
+    parser.add_argument("--no-server", action="store_true", help="run rdf-config once per question instead of the server")
+    args = parser.parse_args()
+
+    jobs = []
+    for spec in args.sweep:
+        database, prompt_id, prompt_variable_id = spec.split(":")
+        with open(os.path.join(os.environ.get("PATH_DIR", ""), "questions", "json_format", f"{database}.json"), "r") as f:
+            questions = json.load(f)
+        jobs.append((database, make_prompt(database, int(prompt_id), int(prompt_variable_id), questions)))
+
+    processor = None
+    if args.local:
+        processor = LocalBatchProcessor(os.path.splitext(args.state)[0] + "_local", args.local_workers)
+    try:
+        sparql_gen_batch(
+            jobs, args.state, processor, args.poll_interval,
+            max_workers=args.concurrency, max_retry=args.max_retry, use_server=not args.no_server,
+        )
+    finally:
+        close_rdf_config_servers()
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    for spec, (database, questions) in zip(args.sweep, jobs):
+        save_path = os.path.join(args.output_dir, f"{spec.replace(':', '_')}_batch.json")
+        with open(save_path, "w") as f:
+            json.dump(questions, f, indent=2)
+        generated = sum(1 for question in questions if "llm_rdf_result" in question)
+        print(f"{spec}: {generated}/{len(questions)} queries generated -> {save_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+# put を何回かするごとに、他のプロセスが書いた分も含めてディレクトリを数え直す
+EVICT_EVERY = 1000
+# 容量を超えたら max_bytes のこの割合まで減らし、毎回の put で数え直さないようにする
+EVICT_TO = 0.9
+
+
+class CacheMiss(KeyError):
+    pass
+
+
+# get_or_call 用の番兵 (キャッシュされた None もヒットとして扱う)
+_MISSING = object()
+
+
+class DiskCache:
+    """
+    On-disk key/value cache, one JSON file per entry.
+
+    When the directory grows beyond max_bytes, the least recently used entries are removed;
+    entries older than ttl seconds (if given) are treated as missing and removed on eviction.
+    The directory size is tracked in memory and the directory is only walked when it goes over
+    max_bytes or every EVICT_EVERY puts. mode is "read_write" (default) or "replay"; in replay
+    mode nothing is written and get_or_call raises CacheMiss on a miss instead of computing the value.
+    """
+
+    def __init__(self, cache_dir, max_bytes=1024 ** 3, mode="read_write", ttl=None):
+        if mode not in ("read_write", "replay"):
+            raise ValueError(f"Unknown cache mode: {mode}")
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.mode = mode
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._evict_lock = threading.Lock()
+        self._total_bytes = None  # 最初の put で数える
+        self._puts = 0
+        os.makedirs(cache_dir, exist_ok=True)
+
+    @staticmethod
+    def hash_key(payload):
+        text = json.dumps(payload, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key + ".json")
+
+    def _count(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def get(self, key, default=None):
+        path = self._path(key)
+        try:
+            with open(path, "r") as f:
+                entry = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            self._count(False)
+            return default
+        if self.ttl is not None and time.time() - entry["created"] > self.ttl:
+            self._count(False)
+            return default
+        # LRU のためにアクセス時刻だけを更新 (更新時刻は作成時刻のまま、TTL の判定に使う)
+        try:
+            os.utime(path, (time.time(), entry["created"]))
+        except FileNotFoundError:
+            pass
+        self._count(True)
+        return entry["value"]
+
+    def put(self, key, value, **metadata):
+        if self.mode == "replay":
+            return
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        created = time.time()
+        with open(tmp_path, "w") as f:
+            json.dump({"created": created, "value": value, **metadata}, f, ensure_ascii=False)
+        size = os.path.getsize(tmp_path)
+        try:
+            replaced = os.stat(path).st_size
+        except FileNotFoundError:
+            replaced = 0
+        os.replace(tmp_path, path)
+        os.utime(path, (created, created))
+        with self._lock:
+            self._puts += 1
+            if self._total_bytes is not None:
+                self._total_bytes += size - replaced
+            evict = (
+                self._total_bytes is None
+                or self._total_bytes > self.max_bytes
+                or self._puts % EVICT_EVERY == 0
+            )
+        if evict:
+            self.evict()
+
+    def evict(self):
+        """
+        Re-count the directory, remove expired entries and, over max_bytes, the least recently used ones.
+        """
+        with self._evict_lock:
+            entries = []
+            total = 0
+            now = time.time()
+            for root, _, files in os.walk(self.cache_dir):
+                for name in files:
+                    if not name.endswith(".json"):
+                        continue
+                    path = os.path.join(root, name)
+                    try:
+                        stat = os.stat(path)
+                    except FileNotFoundError:
+                        continue
+                    # TTL を過ぎたものは容量に関係なく削除 (更新時刻 = 作成時刻)
+                    if self.ttl is not None and now - stat.st_mtime > self.ttl:
+                        self._remove(path)
+                        continue
+                    entries.append((stat.st_atime, stat.st_size, path))
+                    total += stat.st_size
+            if total > self.max_bytes:
+                # 最後に使われたのが古いものから削除
+                for _, size, path in sorted(entries):
+                    self._remove(path)
+                    total -= size
+                    if total <= self.max_bytes * EVICT_TO:
+                        break
+            with self._lock:
+                self._total_bytes = total
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def get_or_call(self, key, call, **metadata):
+        """
+        Return the cached value for key, or run call() and store its result.
+        """
+        value = self.get(key, _MISSING)
+        if value is not _MISSING:
+            return value
+        if self.mode == "replay":
+            raise CacheMiss(f"Cache miss in replay mode: {key}")
+        value = call()
+        self.put(key, value, **metadata)
+        return value
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses}
@@ -0,0 +1,177 @@
+from multiprocessing import Pool, shared_memory
+from typing import Any, Dict, List
+import numpy as np
+import os
+
+from .result_store import ValueInterner, has_results, load_encoded_results, result_fingerprint
+from .results_evaluater import score_jaccard_ids, score_nested_ids, select_nested_columns
+from .score_cache import get_default_score_cache, make_score_key
+
+# ワーカープロセス側で開いた共有メモリ
+_shared = None
+
+
+def _pack_arrays(arrays):
+    """
+    Copy int64 arrays into one shared memory block. Returns the block and (offset, shape) per array.
+    """
+    total = sum(array.size for array in arrays)
+    shm = shared_memory.SharedMemory(create=True, size=max(total, 1) * 8)
+    buffer = np.ndarray((max(total, 1),), dtype=np.int64, buffer=shm.buf)
+    layout = []
+    offset = 0
+    for array in arrays:
+        buffer[offset:offset + array.size] = array.ravel()
+        layout.append((offset, array.shape))
+        offset += array.size
+    return shm, layout
+
+
+def _attach(name):
+    global _shared
+    # 共有メモリの削除は親プロセスが行う
+    _shared = shared_memory.SharedMemory(name=name)
+
+
+def _view(offset, shape):
+    size = int(np.prod(shape))
+    return np.ndarray(shape, dtype=np.int64, buffer=_shared.buf, offset=offset * 8) if size else np.empty(shape, np.int64)
+
+
+def _score_chunk(chunk):
+    results = []
+    for index, metric, q_layout, a_layout, extra in chunk:
+        q_ids, a_ids = _view(*q_layout), _view(*a_layout)
+        if metric == "jaccard":
+            results.append((index, score_jaccard_ids(q_ids, a_ids, extra["missing_id"])))
+            continue
+        try:
+            metrics = score_nested_ids(q_ids, extra["q_columns"], a_ids, extra["a_columns"], extra["missing_id"])
+        except Exception as e:
+            print(f"Error processing ID {extra['id']}: {e}")
+            metrics = {"average_match_rate": 0, "column_matches": {}}
+        results.append((index, metrics))
+    return results
+
+
+def _run_pool(tasks, arrays, processes, chunksize):
+    """
+    Score tasks in a process pool. Each task is (index, metric, q_array_no, a_array_no, extra);
+    the arrays travel through shared memory. Returns {index: result}.
+    """
+    if not tasks:
+        return {}
+    shm, layout = _pack_arrays(arrays)
+    try:
+        chunks = [
+            [(index, metric, layout[q_no], layout[a_no], extra) for index, metric, q_no, a_no, extra in tasks[i:i + chunksize]]
+            for i in range(0, len(tasks), chunksize)
+        ]
+        results = {}
+        with Pool(processes=processes or os.cpu_count(), initializer=_attach, initargs=(shm.name,)) as pool:
+            for chunk_results in pool.imap_unordered(_score_chunk, chunks):
+                results.update(chunk_results)
+        return results
+    finally:
+        shm.close()
+        shm.unlink()
+
+
+def evaluate_jaccard_parallel(
+    questions: List[Dict[str, Any]],
+    answers: List[Dict[str, Any]],
+    processes: int = None,
+    chunksize: int = 4,
+    score_cache=None,
+) -> Dict[str, Any]:
+    """
+    evaluate_jaccard with the per-question scoring spread over a process pool.
+
+    Results are encoded once in this process and handed to the workers through shared memory;
+    identical (question, answer) pairs and pairs found in the score cache are not recomputed.
+    The per-id metrics and the overall average are merged in input order, so the output is
+    the same as evaluate_jaccard.
+    """
+    if score_cache is None:
+        score_cache = get_default_score_cache()
+    interner = ValueInterner()
+    missing_id = interner.intern("missing")  # pad_rows と同じく欠損は "missing" として扱う
+
+    scores = [0] * len(questions)
+    arrays, tasks = [], []
+    key_of = {}  # index -> cache key
+    first_index_of_key = {}
+    for index, (q, a) in enumerate(zip(questions, answers)):
+        if not has_results(q):
+            print(f"Skipping {q['id']} due to missing results.")
+            continue
+        _, q_ids = load_encoded_results(q, interner)
+        _, a_ids = load_encoded_results(a, interner)
+        if q_ids.shape[0] == 0 or q_ids.shape[1] == 0:
+            print(f"Skipping {q['id']} due to empty columns.")
+            continue
+
+        cache_key = make_score_key("jaccard", result_fingerprint(q_ids, interner), result_fingerprint(a_ids, interner))
+        key_of[index] = cache_key
+        if cache_key in first_index_of_key:
+            continue
+        first_index_of_key[cache_key] = index
+        cached = score_cache.get(cache_key) if score_cache is not None else None
+        if cached is not None:
+            scores[index] = cached
+            continue
+        arrays += [q_ids, a_ids]
+        tasks.append((index, "jaccard", len(arrays) - 2, len(arrays) - 1, {"missing_id": missing_id}))
+
+    computed = _run_pool(tasks, arrays, processes, chunksize)
+    for index, score in computed.items():
+        scores[index] = score
+        if score_cache is not None:
+            score_cache.put(key_of[index], score)
+    for index, cache_key in key_of.items():
+        scores[index] = scores[first_index_of_key[cache_key]]
+
+    all_metrics = {}
+    for q, score in zip(questions, scores):
+        all_metrics[q["id"]] = {"jaccard_score": score}
+    overall_average = {
+        "overall_average_jaccard_score": sum(m["jaccard_score"] for m in all_metrics.values()) / len(all_metrics),
+    }
+    return {**all_metrics, **overall_average}
+
+
+def evaluate_nested_data_parallel(
+    questions: List[Dict[str, Any]],
+    answer: List[Dict[str, Any]],
+    processes: int = None,
+    chunksize: int = 4,
+) -> Dict[str, Any]:
+    """
+    evaluate_nested_data with the per-question scoring (column matching and row match rates)
+    spread over a process pool; the output is the same as evaluate_nested_data.
+    """
+    interner = ValueInterner()
+    missing_id = interner.intern("missing")  # pad_rows と同じく欠損は "missing" として扱う
+
+    metrics = [{"average_match_rate": 0, "column_matches": {}} for _ in questions]
+    arrays, tasks = [], []
+    for index, (q, a) in enumerate(zip(questions, answer)):
+        try:
+            q_ids, q_columns, a_ids, a_columns = select_nested_columns(q, a, interner)
+        except Exception as e:
+            print(f"Error processing ID {q['id']}: {e}")
+            continue
+        arrays += [q_ids, a_ids]
+        extra = {"id": q["id"], "q_columns": q_columns, "a_columns": a_columns, "missing_id": missing_id}
+        tasks.append((index, "nested", len(arrays) - 2, len(arrays) - 1, extra))
+
+    for index, result in _run_pool(tasks, arrays, processes, chunksize).items():
+        metrics[index] = result
+
+    all_metrics = {}
+    for q, result in zip(questions, metrics):
+        all_metrics[q["id"]] = result
+    overall_average = {
+        "overall_average_match_rate": sum(m["average_match_rate"] for m in all_metrics.values()) / len(all_metrics)
+    }
+    return {"overall_average": overall_average, "id_metrics": all_metrics}
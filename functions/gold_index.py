@@ -0,0 +1,236 @@
+"""
+Gold-answer index: questions, reference SPARQL, endpoint and gold results of one database
+compiled into a SQLite file keyed by question id.
+
+    python -m functions.gold_index --database rhea --results data/questions/easy_question_augmented_with_results_rhea.json
+
+Sources are questions/json_format/{db}.json, questions/ttl_format/{db}/*.ttl and any questions
+JSON saved with "results". The index is rebuilt only when one of them changes (mtime or size).
+"""
+import argparse
+import glob
+import json
+import os
+import sqlite3
+import threading
+import zlib
+
+INDEX_VERSION = 1
+
+
+def default_results_paths(database, base_dir=""):
+    return sorted(glob.glob(os.path.join(base_dir, "data", "questions", f"*_with_results_{database}.json")))
+
+
+def _source_paths(database, base_dir, results_paths):
+    paths = [os.path.join(base_dir, "questions", "json_format", f"{database}.json")]
+    paths += sorted(glob.glob(os.path.join(base_dir, "questions", "ttl_format", database, "*.ttl")))
+    paths += list(results_paths)
+    return [p for p in paths if os.path.exists(p)]
+
+
+def _signature(paths):
+    signature = [INDEX_VERSION]
+    for path in paths:
+        stat = os.stat(path)
+        signature.append([os.path.abspath(path), stat.st_mtime_ns, stat.st_size])
+    return json.dumps(signature)
+
+
+def load_ttl_questions(paths):
+    """
+    Return {id: {"user_question", "sparql", "endpoint"}} from sh:SPARQLSelectExecutable Turtle files.
+    """
+    from rdflib import Graph, Namespace
+    from rdflib.namespace import RDFS
+
+    SH = Namespace("http://www.w3.org/ns/shacl#")
+    SCHEMA = Namespace("https://schema.org/")
+    questions = {}
+    for path in paths:
+        graph = Graph()
+        graph.parse(path, format="turtle")
+        for subject in graph.subjects(SH.select, None):
+            questions[str(graph.value(subject, RDFS.label))] = {
+                "user_question": str(graph.value(subject, RDFS.comment) or ""),
+                "sparql": str(graph.value(subject, SH.select)),
+                "endpoint": str(graph.value(subject, SCHEMA.target) or ""),
+            }
+    return questions
+
+
+class GoldIndex:
+    """
+    Read access to a compiled gold-answer index. Lookups by id are single primary-key reads.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+
+    @property
+    def _db(self):
+        # sqlite3 の接続はスレッドごとに持つ
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = self._local.db = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True)
+        return db
+
+    def get(self, question_id, with_results=True):
+        """
+        Return the question dict (with "results" when recorded) or None.
+        """
+        row = self._db.execute("SELECT record, results FROM questions WHERE id = ?", (question_id,)).fetchone()
+        if row is None:
+            return None
+        question = json.loads(row[0])
+        if with_results and row[1] is not None:
+            question["results"] = json.loads(zlib.decompress(row[1]))
+        return question
+
+    def __getitem__(self, question_id):
+        question = self.get(question_id)
+        if question is None:
+            raise KeyError(question_id)
+        return question
+
+    def __contains__(self, question_id):
+        return self._db.execute("SELECT 1 FROM questions WHERE id = ?", (question_id,)).fetchone() is not None
+
+    def __len__(self):
+        return self._db.execute("SELECT COUNT(*) FROM questions").fetchone()[0]
+
+    def ids(self, with_results=False):
+        where = " WHERE results IS NOT NULL" if with_results else ""
+        return [row[0] for row in self._db.execute(f"SELECT id FROM questions{where} ORDER BY position")]
+
+    def questions(self):
+        """
+        All questions without results, in the order of questions/json_format.
+        """
+        return [json.loads(row[0]) for row in self._db.execute("SELECT record FROM questions ORDER BY position")]
+
+    def answers_for(self, questions):
+        """
+        Answer dicts (with "results") for the questions that have recorded gold results, for evaluate_jaccard / run_pipeline.
+        """
+        answers = []
+        for question in questions:
+            answer = self.get(question["id"])
+            if answer is not None and "results" in answer:
+                answers.append(answer)
+        return answers
+
+    def close(self):
+        db = getattr(self._local, "db", None)
+        if db is not None:
+            db.close()
+            self._local.db = None
+
+
+def build_gold_index(database, path=None, results_paths=(), base_dir=None, force=False):
+    """
+    Compile the gold-answer index of database into path (default: data/index/{database}.sqlite)
+    unless it is up to date with its sources, and return a GoldIndex on it.
+
+    Question fields come from json_format, the endpoint (and any question only present there) from
+    ttl_format, and "results" from the first of results_paths that has them for the id.
+    """
+    base_dir = base_dir if base_dir is not None else os.environ.get("PATH_DIR", "")
+    path = path or os.path.join(base_dir, "data", "index", f"{database}.sqlite")
+    sources = _source_paths(database, base_dir, results_paths)
+    signature = _signature(sources)
+
+    if not force and os.path.exists(path):
+        try:
+            db = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+            try:
+                current = db.execute("SELECT value FROM meta WHERE key = 'signature'").fetchone()
+            finally:
+                db.close()
+            if current is not None and current[0] == signature:
+                return GoldIndex(path)
+        except sqlite3.DatabaseError:
+            pass  # 壊れている・古い形式なら作り直す
+
+    json_path = os.path.join(base_dir, "questions", "json_format", f"{database}.json")
+    questions = {}
+    if os.path.exists(json_path):
+        with open(json_path, "r") as f:
+            for question in json.load(f):
+                questions.setdefault(question["id"], question)
+    for question_id, ttl in load_ttl_questions([p for p in sources if p.endswith(".ttl")]).items():
+        question = questions.setdefault(question_id, {"id": question_id, "database": database, **ttl})
+        question.setdefault("endpoint", ttl["endpoint"])
+
+    results = {}
+    for results_path in results_paths:
+        with open(results_path, "r") as f:
+            for question in json.load(f):
+                if question.get("results") is not None:
+                    results.setdefault(question["id"], question["results"])
+
+    # 書き込み途中のファイルを読ませないよう、別名で作ってから置き換える
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    db = sqlite3.connect(tmp_path)
+    db.execute("CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT)")
+    db.execute(
+        "CREATE TABLE questions (id TEXT PRIMARY KEY, position INTEGER, record TEXT NOT NULL, results BLOB)"
+    )
+    db.executemany(
+        "INSERT INTO questions VALUES (?, ?, ?, ?)",
+        (
+            (
+                question_id,
+                position,
+                json.dumps(question, ensure_ascii=False),
+                zlib.compress(json.dumps(results[question_id]).encode("utf-8")) if question_id in results else None,
+            )
+            for position, (question_id, question) in enumerate(questions.items())
+        ),
+    )
+    db.executemany("INSERT INTO meta VALUES (?, ?)", [("signature", signature), ("database", database)])
+    db.commit()
+    db.close()
+    os.replace(tmp_path, path)
+    return GoldIndex(path)
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_gold_index(database, results_paths=None):
+    """
+    Return the shared GoldIndex of database, built or refreshed on first use.
+    results_paths defaults to data/questions/*_with_results_{database}.json.
+    """
+    base_dir = os.environ.get("PATH_DIR", "")
+    if results_paths is None:
+        results_paths = default_results_paths(database, base_dir)
+    key = (database, tuple(results_paths))
+    with _indexes_lock:
+        if key not in _indexes:
+            _indexes[key] = build_gold_index(database, results_paths=results_paths, base_dir=base_dir)
+        return _indexes[key]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compile the gold-answer index of a database")
+    parser.add_argument("--database", required=True)
+    parser.add_argument("--results", nargs="*", help="questions JSON with gold results (default: data/questions/*_with_results_{database}.json)")
+    parser.add_argument("--output", help="index path (default: data/index/{database}.sqlite)")
+    parser.add_argument("--force", action="store_true", help="rebuild even if the sources are unchanged")
+    args = parser.parse_args()
+
+    base_dir = os.environ.get("PATH_DIR", "")
+    results_paths = args.results if args.results is not None else default_results_paths(args.database, base_dir)
+    index = build_gold_index(args.database, args.output, results_paths, base_dir, args.force)
+    print(f"{index.path}: {len(index)} questions, {len(index.ids(with_results=True))} with gold results")
+
+
+if __name__ == "__main__":
+    main()
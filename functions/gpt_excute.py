@@ -1,18 +1,211 @@
-from openai import OpenAI
+from openai import (
+    APIConnectionError,
+    APITimeoutError,
+    DefaultHttpxClient,
+    InternalServerError,
+    OpenAI,
+    RateLimitError,
+)
+import httpx
+import os
+import random
+import threading
+import time
 
+from .llm_cache import get_default_cache
+from .tracing import trace_add, trace_set, trace_span
 
-def excute_gpt(content):
+DEFAULT_MODEL_NAME = "gpt-4-1106-preview"
+
+# リトライ対象のエラー (429 / 接続エラー / タイムアウト / 5xx)
+RETRYABLE_ERRORS = (RateLimitError, APIConnectionError, APITimeoutError, InternalServerError)
+
+
+class RateLimiter:
     """
-    Extracts the variable parameter from the query.
+    Requests-per-minute and tokens-per-minute budgets shared by all threads.
+
+    acquire() blocks until both budgets allow the request; a budget of 0 means unlimited.
+    Token use is estimated before the call and corrected with the reported usage afterwards.
     """
-    model_name = "gpt-4-1106-preview"
-    client = OpenAI()
+
+    def __init__(self, requests_per_minute=0, tokens_per_minute=0):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self._request_allowance = float(requests_per_minute)
+        self._token_allowance = float(tokens_per_minute)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed = now - self._updated
+        self._updated = now
+        if self.requests_per_minute:
+            self._request_allowance = min(
+                self.requests_per_minute, self._request_allowance + elapsed * self.requests_per_minute / 60
+            )
+        if self.tokens_per_minute:
+            self._token_allowance = min(
+                self.tokens_per_minute, self._token_allowance + elapsed * self.tokens_per_minute / 60
+            )
+
+    def acquire(self, tokens):
+        if self.tokens_per_minute:
+            # 1 リクエストが予算全体を超える場合でも待ち続けないようにする
+            tokens = min(tokens, self.tokens_per_minute)
+        while True:
+            with self._lock:
+                self._refill()
+                wait = 0.0
+                if self.requests_per_minute and self._request_allowance < 1:
+                    wait = max(wait, (1 - self._request_allowance) * 60 / self.requests_per_minute)
+                if self.tokens_per_minute and self._token_allowance < tokens:
+                    wait = max(wait, (tokens - self._token_allowance) * 60 / self.tokens_per_minute)
+                if wait == 0.0:
+                    if self.requests_per_minute:
+                        self._request_allowance -= 1
+                    if self.tokens_per_minute:
+                        self._token_allowance -= tokens
+                    return
+            time.sleep(wait)
+
+    def record(self, estimated_tokens, used_tokens):
+        if not self.tokens_per_minute:
+            return
+        with self._lock:
+            self._token_allowance -= used_tokens - estimated_tokens
+
+
+_client = None
+_rate_limiter = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    """
+    Return the process-wide OpenAI client. Its HTTP connection pool is kept alive between calls.
+
+    OPENAI_BASE_URL points it at an OpenAI-compatible server (e.g. a local stand-in for tests).
+    """
+    global _client
+    with _client_lock:
+        if _client is None:
+            max_connections = int(os.environ.get("OPENAI_MAX_CONNECTIONS", 20))
+            _client = OpenAI(
+                base_url=os.environ.get("OPENAI_BASE_URL") or None,
+                max_retries=0,
+                http_client=DefaultHttpxClient(
+                    limits=httpx.Limits(
+                        max_connections=max_connections,
+                        max_keepalive_connections=max_connections,
+                    )
+                ),
+            )
+        return _client
+
+
+def get_rate_limiter():
+    """
+    Return the process-wide RateLimiter configured by OPENAI_RPM / OPENAI_TPM.
+    """
+    global _rate_limiter
+    with _client_lock:
+        if _rate_limiter is None:
+            _rate_limiter = RateLimiter(
+                requests_per_minute=int(os.environ.get("OPENAI_RPM", 0)),
+                tokens_per_minute=int(os.environ.get("OPENAI_TPM", 0)),
+            )
+        return _rate_limiter
+
+
+def _retry_after(error):
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    try:
+        return float(response.headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+def _estimate_tokens(messages):
+    # 概算: 英語でおよそ 4 文字 = 1 トークン、出力分として 1000 トークンを見込む
+    return sum(len(m["content"]) for m in messages) // 4 + 1000
+
+
+def create_chat_completion(messages, model_name, params, max_attempts=6, base_delay=1.0, max_delay=60.0):
+    """
+    Call chat.completions.create on the shared client within the rate-limit budgets,
+    retrying 429 / connection / 5xx errors with jittered exponential backoff.
+    """
+    client = get_client()
+    rate_limiter = get_rate_limiter()
+    estimated_tokens = _estimate_tokens(messages)
+
+    attempt = 0
+    while True:
+        rate_limiter.acquire(estimated_tokens)
+        try:
+            completion = client.chat.completions.create(
+                model=model_name,
+                messages=messages,
+                **params,
+            )
+        except RETRYABLE_ERRORS as e:
+            attempt += 1
+            if attempt >= max_attempts:
+                raise
+            trace_add("retries")
+            delay = _retry_after(e)
+            if delay is None:
+                delay = random.uniform(0, min(max_delay, base_delay * 2 ** attempt))
+            print(f"OpenAI {type(e).__name__}, retry {attempt} in {delay:.1f}s")
+            time.sleep(delay)
+            continue
+
+        if completion.usage is not None:
+            rate_limiter.record(estimated_tokens, completion.usage.total_tokens)
+            trace_add("prompt_tokens", completion.usage.prompt_tokens)
+            trace_add("completion_tokens", completion.usage.completion_tokens)
+        return completion
+
+
+def build_chat_request(content, model_name=None, temperature=None):
+    """
+    Return (model_name, messages, params) of the chat completion excute_gpt sends for content.
+    """
+    if model_name is None:
+        model_name = os.environ.get("OPENAI_MODEL", DEFAULT_MODEL_NAME)
+    if temperature is None and os.environ.get("OPENAI_TEMPERATURE"):
+        temperature = float(os.environ["OPENAI_TEMPERATURE"])
 
     prompt = {"role": "user", "content": content}
+    messages = [prompt]
+    params = {}
+    if temperature is not None:
+        params["temperature"] = temperature
+    return model_name, messages, params
+
+
+def excute_gpt(content, cache=None, model_name=None, temperature=None):
+    """
+    Extracts the variable parameter from the query.
+
+    model_name and temperature default to OPENAI_MODEL / OPENAI_TEMPERATURE.
+    Outputs are served from / stored in cache (an LLMCache), or the cache configured
+    by LLM_CACHE_DIR when cache is None.
+    """
+    model_name, messages, params = build_chat_request(content, model_name, temperature)
+
+    def call():
+        trace_set(cache_hit=False)
+        completion = create_chat_completion(messages, model_name, params)
+        return completion.choices[0].message.content
 
-    completion = client.chat.completions.create(
-        model=model_name,
-        messages=[prompt],
-    )
-    gpt_output = completion.choices[0].message.content
-    return gpt_output
+    if cache is None:
+        cache = get_default_cache()
+    with trace_span("llm", model=model_name, cache_hit=True):
+        if cache is None:
+            return call()
+        return cache.get_or_call(model_name, messages, params, call)
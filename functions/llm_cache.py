@@ -0,0 +1,44 @@
+import os
+import threading
+
+from .disk_cache import DiskCache
+
+
+class LLMCache(DiskCache):
+    """
+    Cache of LLM outputs keyed on a SHA-256 of the model name, the messages and the sampling parameters.
+    """
+
+    @staticmethod
+    def make_key(model, messages, params):
+        return DiskCache.hash_key({"model": model, "messages": messages, "params": params})
+
+    def get_or_call(self, model, messages, params, call):
+        """
+        Return the cached output for the request, or run call() and store its output.
+        """
+        key = self.make_key(model, messages, params)
+        return super().get_or_call(key, call, model=model)
+
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+
+def get_default_cache():
+    """
+    Return the cache configured by LLM_CACHE_DIR / LLM_CACHE_MODE / LLM_CACHE_MAX_BYTES, or None.
+    """
+    global _default_cache
+    cache_dir = os.environ.get("LLM_CACHE_DIR")
+    if not cache_dir:
+        return None
+    with _default_cache_lock:
+        if _default_cache is None or _default_cache.cache_dir != cache_dir:
+            _default_cache = LLMCache(
+                cache_dir,
+                max_bytes=int(os.environ.get("LLM_CACHE_MAX_BYTES", 1024 ** 3)),
+                mode=os.environ.get("LLM_CACHE_MODE", "read_write"),
+            )
+        return _default_cache
+
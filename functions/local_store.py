@@ -0,0 +1,329 @@
+"""
+Embedded SPARQL backend: runs query text with rdflib against an RDF snapshot (N-Triples / Turtle,
+optionally gzipped) indexed once into SQLite, so a benchmark can run without the public endpoints.
+
+An endpoint of the form "local:PATH" (a snapshot file or a directory of them) is executed here
+instead of over HTTP, e.g. ENDPOINT_RHEA=local:data/snapshots/rhea.nt. The index
+(PATH.sqlite, or PATH/index.sqlite for a directory) is rebuilt only when a snapshot file changes.
+
+    python -m functions.local_store data/snapshots/rhea.nt --query "SELECT * WHERE { ?s ?p ?o } LIMIT 3"
+"""
+from collections import OrderedDict
+import argparse
+import glob
+import gzip
+import json
+import os
+import sqlite3
+import threading
+
+from rdflib import BNode, Graph, Literal, URIRef
+from rdflib.plugins.parsers.ntriples import W3CNTriplesParser
+from rdflib.plugins.sparql import prepareQuery
+from rdflib.store import Store
+from rdflib.util import guess_format
+
+LOCAL_PREFIX = "local:"
+INDEX_VERSION = 1
+SNAPSHOT_EXTENSIONS = (".nt", ".ttl", ".nt.gz", ".ttl.gz")
+TERM_CACHE_SIZE = 1 << 20
+
+_URI, _BNODE, _LITERAL = 0, 1, 2
+
+
+def is_local_endpoint(endpoint):
+    return endpoint.startswith(LOCAL_PREFIX)
+
+
+def _snapshot_files(snapshot):
+    if os.path.isdir(snapshot):
+        return sorted(p for p in glob.glob(os.path.join(snapshot, "*")) if p.endswith(SNAPSHOT_EXTENSIONS))
+    return [snapshot]
+
+
+def index_path(snapshot):
+    return os.path.join(snapshot, "index.sqlite") if os.path.isdir(snapshot) else snapshot + ".sqlite"
+
+
+def _signature(paths):
+    signature = [INDEX_VERSION]
+    for path in paths:
+        stat = os.stat(path)
+        signature.append([os.path.abspath(path), stat.st_mtime_ns, stat.st_size])
+    return json.dumps(signature)
+
+
+def _term_key(term):
+    if isinstance(term, URIRef):
+        return (_URI, str(term), "", "")
+    if isinstance(term, BNode):
+        return (_BNODE, str(term), "", "")
+    if isinstance(term, Literal):
+        return (_LITERAL, str(term), str(term.datatype or ""), term.language or "")
+    return None
+
+
+def _make_term(kind, value, datatype, lang):
+    if kind == _URI:
+        return URIRef(value)
+    if kind == _BNODE:
+        return BNode(value)
+    return Literal(value, lang=lang or None, datatype=URIRef(datatype) if datatype else None)
+
+
+class _Sink:
+    def __init__(self, add):
+        self.add = add
+
+    def triple(self, s, p, o):
+        self.add((s, p, o))
+
+
+def _iter_snapshot_triples(path, flush):
+    """
+    Parse a snapshot and pass its triples to flush() in batches. N-Triples is streamed; other formats go through a Graph.
+    """
+    batch = []
+
+    def add(triple):
+        batch.append(triple)
+        if len(batch) >= 100_000:
+            flush(batch)
+            batch.clear()
+
+    name = path[:-3] if path.endswith(".gz") else path
+    opener = gzip.open if path.endswith(".gz") else open
+    fmt = guess_format(name) or "turtle"
+    with opener(path, "rb") as f:
+        if fmt in ("nt", "nt11"):
+            W3CNTriplesParser(_Sink(add)).parse(f)
+        else:
+            graph = Graph()
+            graph.parse(f, format=fmt)
+            for triple in graph:
+                add(triple)
+    flush(batch)
+
+
+def build_index(snapshot, path=None, force=False):
+    """
+    Index the triples of snapshot into SQLite (term table + spo / pos / osp indexes) unless the
+    index is up to date, and return its path.
+    """
+    path = path or index_path(snapshot)
+    files = _snapshot_files(snapshot)
+    if not files:
+        raise FileNotFoundError(f"No RDF snapshot found at {snapshot}")
+    signature = _signature(files)
+    if not force and os.path.exists(path):
+        try:
+            db = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+            try:
+                current = db.execute("SELECT value FROM meta WHERE key = 'signature'").fetchone()
+            finally:
+                db.close()
+            if current is not None and current[0] == signature:
+                return path
+        except sqlite3.DatabaseError:
+            pass  # 壊れている・古い形式なら作り直す
+
+    # 書き込み途中のファイルを読ませないよう、別名で作ってから置き換える
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    db = sqlite3.connect(tmp_path)
+    db.executescript(
+        """
+        PRAGMA journal_mode = OFF;
+        PRAGMA synchronous = OFF;
+        CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT);
+        CREATE TABLE terms (id INTEGER PRIMARY KEY, kind INTEGER, value TEXT, datatype TEXT, lang TEXT);
+        CREATE TABLE triples (s INTEGER, p INTEGER, o INTEGER, PRIMARY KEY (s, p, o)) WITHOUT ROWID;
+        """
+    )
+    term_ids = {}
+
+    def term_id(term):
+        key = _term_key(term)
+        tid = term_ids.get(key)
+        if tid is None:
+            tid = term_ids[key] = len(term_ids) + 1
+            new_terms.append((tid, *key))
+        return tid
+
+    def flush(batch):
+        new_terms.clear()
+        rows = [(term_id(s), term_id(p), term_id(o)) for s, p, o in batch]
+        db.executemany("INSERT INTO terms VALUES (?, ?, ?, ?, ?)", new_terms)
+        db.executemany("INSERT OR IGNORE INTO triples VALUES (?, ?, ?)", rows)
+
+    new_terms = []
+    for file in files:
+        _iter_snapshot_triples(file, flush)
+    db.executescript(
+        """
+        CREATE UNIQUE INDEX terms_key ON terms (kind, value, datatype, lang);
+        CREATE INDEX triples_pos ON triples (p, o, s);
+        CREATE INDEX triples_osp ON triples (o, s, p);
+        """
+    )
+    db.executemany("INSERT INTO meta VALUES (?, ?)", [("signature", signature), ("snapshot", snapshot)])
+    db.commit()
+    db.close()
+    os.replace(tmp_path, path)
+    return path
+
+
+class SQLiteTripleStore(Store):
+    """
+    Read-only rdflib store over an index written by build_index; rdflib's SPARQL engine
+    resolves each triple pattern with one indexed SQLite query.
+    """
+
+    context_aware = False
+    formula_aware = False
+    transaction_aware = False
+    graph_aware = False
+
+    def __init__(self, path):
+        super().__init__()
+        self.path = path
+        self._local = threading.local()
+        self._terms = OrderedDict()
+        self._ids = {}
+        self._cache_lock = threading.Lock()
+
+    @property
+    def _db(self):
+        # sqlite3 の接続はスレッドごとに持つ
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = self._local.db = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True)
+        return db
+
+    def _term(self, tid):
+        term = self._terms.get(tid)
+        if term is None:
+            row = self._db.execute("SELECT kind, value, datatype, lang FROM terms WHERE id = ?", (tid,)).fetchone()
+            term = _make_term(*row)
+            with self._cache_lock:
+                self._terms[tid] = term
+                if len(self._terms) > TERM_CACHE_SIZE:
+                    self._terms.popitem(last=False)
+        return term
+
+    def _term_id(self, term):
+        key = _term_key(term)
+        if key is None:
+            return None
+        tid = self._ids.get(key)
+        if tid is None:
+            row = self._db.execute(
+                "SELECT id FROM terms WHERE kind = ? AND value = ? AND datatype = ? AND lang = ?", key
+            ).fetchone()
+            if row is None:
+                return None
+            tid = row[0]
+            with self._cache_lock:
+                if len(self._ids) > TERM_CACHE_SIZE:
+                    self._ids.clear()
+                self._ids[key] = tid
+        return tid
+
+    def triples(self, triple_pattern, context=None):
+        conditions, params = [], []
+        for column, term in zip(("s", "p", "o"), triple_pattern):
+            if term is None:
+                continue
+            tid = self._term_id(term)
+            if tid is None:
+                return  # 存在しない項には一致しない
+            conditions.append(f"{column} = ?")
+            params.append(tid)
+        sql = "SELECT s, p, o FROM triples"
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        for s, p, o in self._db.execute(sql, params).fetchall():
+            yield (self._term(s), self._term(p), self._term(o)), iter(())
+
+    def __len__(self, context=None):
+        return self._db.execute("SELECT COUNT(*) FROM triples").fetchone()[0]
+
+    def contexts(self, triple=None):
+        return iter(())
+
+    def add(self, triple, context, quoted=False):
+        raise TypeError("SQLiteTripleStore is read-only")
+
+    def remove(self, triple, context=None):
+        raise TypeError("SQLiteTripleStore is read-only")
+
+    def close(self, commit_pending_transaction=False):
+        db = getattr(self._local, "db", None)
+        if db is not None:
+            db.close()
+            self._local.db = None
+
+
+class LocalSparqlStore:
+    """
+    SPARQL over one snapshot. query() returns SPARQL JSON result bindings like an endpoint.
+    """
+
+    def __init__(self, snapshot, path=None):
+        self.snapshot = snapshot
+        self.path = build_index(snapshot, path)
+        self.graph = Graph(store=SQLiteTripleStore(self.path))
+
+    def query(self, query_text):
+        with _parse_lock:
+            parsed = prepareQuery(query_text)
+        result = json.loads(self.graph.query(parsed).serialize(format="json"))
+        head_vars = result.get("head", {}).get("vars")
+        if head_vars and "results" in result:
+            # rdflib は束縛のキーを SELECT の順に並べないので、エンドポイントと同じ head.vars の順にする
+            result["results"]["bindings"] = [
+                {var: binding[var] for var in head_vars if var in binding} for binding in result["results"]["bindings"]
+            ]
+        return result
+
+    def close(self):
+        self.graph.store.close()
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+# rdflib の SPARQL パーサ (pyparsing) はスレッドセーフでないので、解析だけ直列にする
+_parse_lock = threading.Lock()
+
+
+def get_local_store(endpoint):
+    """
+    Return the shared LocalSparqlStore for a "local:PATH" endpoint (PATH relative to PATH_DIR if not absolute).
+    """
+    snapshot = endpoint[len(LOCAL_PREFIX):]
+    if not os.path.isabs(snapshot):
+        snapshot = os.path.join(os.environ.get("PATH_DIR", ""), snapshot)
+    with _stores_lock:
+        store = _stores.get(snapshot)
+        if store is None:
+            store = _stores[snapshot] = LocalSparqlStore(snapshot)
+        return store
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Index an RDF snapshot for local SPARQL execution")
+    parser.add_argument("snapshot", help="N-Triples / Turtle file or directory")
+    parser.add_argument("--force", action="store_true", help="rebuild even if the snapshot is unchanged")
+    parser.add_argument("--query", help="run this query against the snapshot and print the bindings")
+    args = parser.parse_args()
+
+    path = build_index(args.snapshot, force=args.force)
+    store = LocalSparqlStore(args.snapshot, path)
+    print(f"{path}: {len(store.graph)} triples")
+    if args.query:
+        print(json.dumps(store.query(args.query)["results"]["bindings"], indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,211 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import os
+
+from .gpt_excute import DEFAULT_MODEL_NAME
+from .prompt_maker import fill_template_with_params, load_prompt
+from .result_store import (
+    ColumnarResult,
+    ValueInterner,
+    encode_columnar,
+    has_results,
+    load_encoded_results,
+    result_fingerprint,
+)
+from .results_evaluater import score_jaccard_ids
+from .score_cache import SCORE_VERSION
+from .SPARQL_executer import execute_one_query, prepare_query_text
+from .SPARQL_generator import generate_sparql_for_question
+from .tracing import trace_context, trace_span
+
+# パイプラインの段階 (この順に実行する)
+STAGES = ("prompt", "generate", "execute", "evaluate")
+
+
+def prompt_stage(store, question, prompt, variable):
+    params = {**variable, **question}
+    # テンプレートが使う値だけを入力とする
+    inputs = {"prompt": prompt["prompt"], "params": {field: params.get(field) for field in prompt["variables"]}}
+
+    def call():
+        return {"prompt_filled": fill_template_with_params(prompt, params)}
+
+    return store.run("prompt", question["id"], inputs, call)
+
+
+def generate_stage(store, database, question, verbose=False, max_retry=3, use_server=True):
+    inputs = {
+        "database": database,
+        "id": question["id"],
+        "prompt_filled": question["prompt_filled"],
+        "model": os.environ.get("OPENAI_MODEL", DEFAULT_MODEL_NAME),
+        "temperature": os.environ.get("OPENAI_TEMPERATURE") or None,
+    }
+
+    def call():
+        generated = generate_sparql_for_question(
+            database, {"id": question["id"], "prompt_filled": question["prompt_filled"]}, verbose, max_retry, use_server
+        )
+        if "llm_rdf_result" not in generated:
+            return None
+        return {key: generated[key] for key in ("llm_output", "llm_variable", "llm_parameter", "llm_rdf_result")}
+
+    return store.run("generate", question["id"], inputs, call)
+
+
+def execute_stage(store, question, endpoint, limit_number=10000, prefix="", cache=None, sparql_key_name="llm_rdf_result", stage="execute"):
+    """
+    Execute the question's query and return {"results_path", "rows", "results_fingerprint"}.
+
+    The results are written as columnar data under store.results_dir; the checkpoint only
+    records where they are, so a reused record is only valid while that file exists.
+    """
+    query_text = prepare_query_text(question, sparql_key_name, limit_number, prefix)
+    inputs = {"endpoint": endpoint, "query": query_text}
+    path = store.results_path(stage, question["id"], store.hash_inputs(inputs))
+
+    def call():
+        try:
+            result = ColumnarResult.from_bindings(
+                execute_one_query(question[sparql_key_name], endpoint, cache, limit_number=limit_number, prefix=prefix)
+            )
+        except Exception as e:
+            # 失敗は記録せず、次の実行でやり直す
+            print(f"Execute Error: {e}")
+            print(question["id"])
+            return None
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        result.save(path)
+        interner = ValueInterner()
+        _, ids = encode_columnar(result, interner)
+        return {"results_path": path, "rows": len(result), "results_fingerprint": result_fingerprint(ids, interner)}
+
+    # 結果ファイルのない (消された・古い形式の) 記録は使わない
+    return store.run(
+        stage, question["id"], inputs, call,
+        reuse=lambda output: "results_path" in output and os.path.exists(output["results_path"]),
+    )
+
+
+def gold_stage(store, question, endpoint, limit_number=10000, prefix="", cache=None):
+    """
+    Execute the reference query (question["sparql"]) and return an answer dict for evaluation.
+    """
+    executed = execute_stage(store, question, endpoint, limit_number, prefix, cache, "sparql", "gold")
+    answer = {key: value for key, value in question.items() if key not in ("results", "results_path")}
+    return {**answer, **(executed or {"results": []})}
+
+
+def _results_fingerprint(result):
+    interner = ValueInterner()
+    _, ids = load_encoded_results(result, interner)
+    return result_fingerprint(ids, interner)
+
+
+def evaluate_stage(store, question, answer):
+    if not has_results(question):
+        print(f"Skipping {question['id']} due to missing results.")
+        return {"jaccard_score": 0}
+    if question.get("rows") == 0:
+        print(f"Skipping {question['id']} due to empty columns.")
+        return {"jaccard_score": 0}
+
+    # 評価方法を変えたら SCORE_VERSION を上げる (評価段階だけが再計算される)
+    # execute 段階で記録した指紋があれば、結果を読み込まずに記録済みの評価を探せる
+    inputs = {
+        "metric": "jaccard",
+        "version": SCORE_VERSION,
+        "predicted": question.get("results_fingerprint") or _results_fingerprint(question),
+        "gold": answer.get("results_fingerprint") or _results_fingerprint(answer),
+    }
+
+    def call():
+        interner = ValueInterner()
+        missing_id = interner.intern("missing")  # pad_rows と同じく欠損は "missing" として扱う
+        _, q_ids = load_encoded_results(question, interner)
+        _, a_ids = load_encoded_results(answer, interner)
+        if q_ids.shape[0] == 0 or q_ids.shape[1] == 0:
+            print(f"Skipping {question['id']} due to empty columns.")
+            return {"jaccard_score": 0}
+        return {"jaccard_score": score_jaccard_ids(q_ids, a_ids, missing_id)}
+
+    return store.run("evaluate", question["id"], inputs, call)
+
+
+def run_pipeline(
+    store,
+    database,
+    questions,
+    answers,
+    prompt_id,
+    prompt_variable_id,
+    endpoint,
+    limit_number=10000,
+    prefix="",
+    verbose=False,
+    generate_workers=1,
+    execute_workers=1,
+    max_retry=3,
+    use_server=True,
+    cache=None,
+):
+    """
+    make_prompt → sparql_gen → execute_query → evaluate_jaccard with every stage checkpointed in store (a RunStore).
+
+    The stages are pipelined: prompts are generated by generate_workers threads and each question
+    is handed to the execute_workers threads (query execution and evaluation) as soon as its
+    query is generated, so question N+1 is generating while question N is executing.
+
+    answers is a list of answer dicts matched to questions by id, or None to execute the
+    reference queries (question["sparql"]) as a checkpointed "gold" stage. A restarted run skips
+    each stage whose inputs hash to a recorded output, so after an interruption only unfinished
+    questions are processed, and a change to the evaluator (SCORE_VERSION) only recomputes the
+    evaluation. Each stage is traced as a span (see functions.tracing) with the database and
+    question id. Returns the same metrics layout as evaluate_jaccard.
+    """
+    prompt, variable = load_prompt(database, prompt_id, prompt_variable_id)
+    answer_by_id = None if answers is None else {a["id"]: a for a in answers}
+
+    def generate(question):
+        with trace_context(database=database, question_id=question["id"]):
+            with trace_span("prompt"):
+                question.update(prompt_stage(store, question, prompt, variable))
+            with trace_span("generate"):
+                generated = generate_stage(store, database, question, verbose, max_retry, use_server)
+        if generated is not None:
+            question.update(generated)
+        return generated is not None
+
+    def execute(question):
+        with trace_context(database=database, question_id=question["id"]):
+            with trace_span("execute"):
+                executed = execute_stage(store, question, endpoint, limit_number, prefix, cache)
+            if executed is None:
+                return {"jaccard_score": 0}
+            question.pop("results", None)
+            question.update(executed)
+            if answer_by_id is None:
+                with trace_span("gold"):
+                    answer = gold_stage(store, question, endpoint, limit_number, prefix, cache)
+            else:
+                answer = answer_by_id[question["id"]]
+            with trace_span("evaluate"):
+                return evaluate_stage(store, question, answer)
+
+    metrics = [{"jaccard_score": 0}] * len(questions)
+    with ThreadPoolExecutor(max_workers=generate_workers) as generate_pool, \
+            ThreadPoolExecutor(max_workers=execute_workers) as execute_pool:
+        generating = {generate_pool.submit(generate, question): i for i, question in enumerate(questions)}
+        executing = {}
+        # 生成が終わった質問から順に実行に回す
+        for future in as_completed(generating):
+            i = generating[future]
+            if future.result():
+                executing[execute_pool.submit(execute, questions[i])] = i
+        for future, i in executing.items():
+            metrics[i] = future.result()
+
+    all_metrics = {question["id"]: m for question, m in zip(questions, metrics)}
+    overall_average = {
+        "overall_average_jaccard_score": sum(m["jaccard_score"] for m in all_metrics.values()) / len(all_metrics),
+    }
+    return {**all_metrics, **overall_average}
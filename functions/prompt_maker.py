@@ -1,41 +1,146 @@
+from functools import lru_cache
 import json
 import os
+import re
+import threading
 
+# demo_propose.ipynb と同じデフォルトのプロンプト ID (database -> (prompt_id, prompt_variable_id))
+DEFAULT_PROMPT_IDS = {
+    "uniprot": (2, 2),
+    "rhea": (5, 4),
+    "bgee": (6, 5),
+    "uniprot_and_bgee": (7, 12),
+}
 
-def make_prompt(
-    database: str, prompt_id: int, prompt_variable_id: int, questions: list
-):
+
+class CompiledTemplate:
+    """
+    Prompt template split once into literal segments and placeholder names,
+    so filling it is a single join instead of one str.replace per variable.
+    """
+
+    def __init__(self, text, variables):
+        self.variables = tuple(variables)
+        self.literals = [text]
+        self.fields = []
+        if self.variables:
+            pattern = re.compile("|".join(re.escape(f"{{{v}}}") for v in self.variables))
+            self.literals = []
+            position = 0
+            for match in pattern.finditer(text):
+                self.literals.append(text[position:match.start()])
+                self.fields.append(match.group(0)[1:-1])
+                position = match.end()
+            self.literals.append(text[position:])
+
+    def fill(self, params):
+        for input_field in self.variables:
+            if input_field not in params:
+                raise ValueError(f"変数 {input_field} がパラメータに見つかりません。")
+        pieces = [self.literals[0]]
+        for field, literal in zip(self.fields, self.literals[1:]):
+            pieces.append(str(params[field]))
+            pieces.append(literal)
+        return "".join(pieces)
+
+
+@lru_cache(maxsize=256)
+def compile_template(text, variables):
+    return CompiledTemplate(text, variables)
+
+
+class PromptCatalog:
+    """
+    prompts.json / variables.json loaded once and indexed by (database, id).
+    The files are re-read only when their mtime or size changes. Returned entries are shared; do not modify them.
+    """
+
+    def __init__(self, path_prompts, path_variables):
+        self.path_prompts = path_prompts
+        self.path_variables = path_variables
+        self._signature = None
+        self._lock = threading.Lock()
+
+    def _file_signature(self):
+        signature = []
+        for path in (self.path_prompts, self.path_variables):
+            stat = os.stat(path)
+            signature.append((stat.st_mtime_ns, stat.st_size))
+        return tuple(signature)
+
+    def _refresh(self):
+        signature = self._file_signature()
+        if signature == self._signature:
+            return
+        with self._lock:
+            if signature == self._signature:
+                return
+            # 指定されたファイルからJSONデータをロードします
+            with open(self.path_prompts, "r") as f:
+                prompts = json.load(f)
+            with open(self.path_variables, "r") as f:
+                variables = json.load(f)
+            self._prompts = {(v["database"], v["id"]): v for v in reversed(prompts)}
+            self._variables = {(v["database"], v["id"]): v for v in reversed(variables)}
+            self._templates = {
+                key: compile_template(v["prompt"], tuple(v["variables"])) for key, v in self._prompts.items()
+            }
+            self._prompt_databases = {v["database"] for v in prompts}
+            self._variable_databases = {v["database"] for v in variables}
+            self._signature = signature
+
+    def get(self, database, prompt_id, prompt_variable_id):
+        """
+        Return (prompt entry, variables entry, compiled template).
+        """
+        self._refresh()
+        if database not in self._prompt_databases or database not in self._variable_databases:
+            raise ValueError(f"データベース {database} はJSONファイルに存在しません。")
+
+        prompt = self._prompts.get((database, prompt_id))
+        variable = self._variables.get((database, prompt_variable_id))
+        if not prompt or not variable:
+            raise ValueError(
+                f"ID {prompt_id} または {prompt_variable_id} のプロンプトまたは変数が見つかりません。"
+            )
+        return prompt, variable, self._templates[(database, prompt_id)]
+
+
+_catalogs = {}
+_catalogs_lock = threading.Lock()
+
+
+def get_prompt_catalog():
+    """
+    Return the shared PromptCatalog for PATH_DIR + PATH_PROMPTS / PATH_VARIABLES.
+    """
     path_prompts = os.environ["PATH_DIR"] + os.environ["PATH_PROMPTS"]
     path_variables = os.environ["PATH_DIR"] + os.environ["PATH_VARIABLES"]
+    with _catalogs_lock:
+        catalog = _catalogs.get((path_prompts, path_variables))
+        if catalog is None:
+            catalog = _catalogs[(path_prompts, path_variables)] = PromptCatalog(path_prompts, path_variables)
+        return catalog
 
-    # 指定されたファイルからJSONデータをロードします
-    with open(path_prompts, "r") as f:
-        prompts = json.load(f)
-    with open(path_variables, "r") as f:
-        variables = json.load(f)
-
-    # JSONデータから特定のエントリを取得します
-    prompts_database = [v for v in prompts if v["database"] == database]
-    variable_database = [v for v in variables if v["database"] == database]
 
-    if not prompts_database or not variable_database:
-        raise ValueError(f"データベース {database} はJSONファイルに存在しません。")
+def load_prompt(database: str, prompt_id: int, prompt_variable_id: int):
+    """
+    Return the (prompt template, variables) entries for the database and ids.
+    """
+    prompt, variable, _ = get_prompt_catalog().get(database, prompt_id, prompt_variable_id)
+    return prompt, variable
 
-    prompt = next((v for v in prompts_database if v["id"] == prompt_id), None)
-    variable = next(
-        (v for v in variable_database if v["id"] == prompt_variable_id), None
-    )
 
-    if not prompt or not variable:
-        raise ValueError(
-            f"ID {prompt_id} または {prompt_variable_id} のプロンプトまたは変数が見つかりません。"
-        )
+def make_prompt(
+    database: str, prompt_id: int, prompt_variable_id: int, questions: list
+):
+    _, variable, template = get_prompt_catalog().get(database, prompt_id, prompt_variable_id)
 
     # 質問ごとにプロンプトを生成
     results = []
     for question in questions:
         params = {**variable, **question}  # 変数と質問の辞書をマージします
-        filled_prompt = fill_template_with_params(prompt, params)
+        filled_prompt = template.fill(params)
 
         # 質問辞書に追加情報を追加します
         question["prompt_id"] = prompt_id
@@ -50,54 +155,23 @@ def fill_template_with_params(template, params):
     """
     テンプレートのプレースホルダーをユーザーから提供されたパラメータおよび変数で置き換えます。
     """
-    text = template["prompt"]
-    for input_field in template["variables"]:
-        if input_field in params:
-            text = text.replace(f"{{{input_field}}}", str(params[input_field]))
-        else:
-            raise ValueError(f"変数 {input_field} がパラメータに見つかりません。")
-
     # 埋められたプロンプトを評価します
-    return text
+    return compile_template(template["prompt"], tuple(template["variables"])).fill(params)
 
 
+# make_one_prompt で使うデータベースごとのプロンプト ID
+ONE_PROMPT_IDS = {
+    "uniprot": (2, 2),
+    "rhea": (5, 4),
+    "bgee": (6, 5),
+}
 
 
 def make_one_prompt(
     database: str, user_question: str
 ):
-    path_prompts = os.environ["PATH_DIR"] + os.environ["PATH_PROMPTS"]
-    path_variables = os.environ["PATH_DIR"] + os.environ["PATH_VARIABLES"]
+    prompt_id, prompt_variable_id = ONE_PROMPT_IDS.get(database, (None, None))
+    _, variable, template = get_prompt_catalog().get(database, prompt_id, prompt_variable_id)
 
-    # 指定されたファイルからJSONデータをロードします
-    with open(path_prompts, "r") as f:
-        prompts = json.load(f)
-    with open(path_variables, "r") as f:
-        variables = json.load(f)
-
-    # JSONデータから特定のエントリを取得します
-    prompts_database = [v for v in prompts if v["database"] == database]
-    variable_database = [v for v in variables if v["database"] == database]
-
-    if database == 'uniprot':
-        prompt_id = 2
-        prompt_variable_id = 2
-    elif database == 'rhea':
-        prompt_id = 5
-        prompt_variable_id = 4
-    elif database == 'bgee':
-        prompt_id = 6
-        prompt_variable_id = 5
-
-    prompt = next((v for v in prompts_database if v["id"] == prompt_id), None)
-    variable = next(
-        (v for v in variable_database if v["id"] == prompt_variable_id), None
-    )
-
-    variable["user_question"] = user_question
-
-    final_prompt = prompt["prompt"]
-    for _variable in prompt["variables"]:
-        final_prompt = final_prompt.replace(f"{{{_variable}}}", variable[_variable])
-
-    return final_prompt
+    # カタログの辞書は共有されているので書き換えない
+    return template.fill({**variable, "user_question": user_question})
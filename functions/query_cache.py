@@ -0,0 +1,60 @@
+import os
+import re
+import threading
+
+from .disk_cache import DiskCache
+
+# 文字列リテラルはそのまま残し、それ以外の空白を 1 つにまとめる
+_LITERAL_OR_SPACE = re.compile(
+    r'("""[\s\S]*?"""|\'\'\'[\s\S]*?\'\'\'|"(?:[^"\\\n]|\\.)*"|\'(?:[^\'\\\n]|\\.)*\')|\s+'
+)
+
+
+def normalize_query_text(query_text):
+    """
+    Normalize a query for use as a cache key: drop comment lines and collapse whitespace outside literals.
+    """
+    query_text = re.sub(r'(?m)^\s*#.*$', '', query_text)
+    query_text = _LITERAL_OR_SPACE.sub(lambda m: m.group(1) if m.group(1) else " ", query_text)
+    return query_text.strip()
+
+
+class QueryResultCache(DiskCache):
+    """
+    Cache of SPARQL result bindings keyed on the endpoint and the normalized query text.
+    """
+
+    @staticmethod
+    def make_key(endpoint, query_text):
+        return DiskCache.hash_key({"endpoint": endpoint, "query": normalize_query_text(query_text)})
+
+    def get_or_call(self, endpoint, query_text, call):
+        """
+        Return the cached bindings for the query, or run call() and store its bindings.
+        """
+        key = self.make_key(endpoint, query_text)
+        return super().get_or_call(key, call, endpoint=endpoint)
+
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+
+def get_default_query_cache():
+    """
+    Return the cache configured by QUERY_CACHE_DIR / QUERY_CACHE_TTL / QUERY_CACHE_MAX_BYTES, or None.
+    """
+    global _default_cache
+    cache_dir = os.environ.get("QUERY_CACHE_DIR")
+    if not cache_dir:
+        return None
+    with _default_cache_lock:
+        if _default_cache is None or _default_cache.cache_dir != cache_dir:
+            ttl = os.environ.get("QUERY_CACHE_TTL")
+            _default_cache = QueryResultCache(
+                cache_dir,
+                max_bytes=int(os.environ.get("QUERY_CACHE_MAX_BYTES", 4 * 1024 ** 3)),
+                mode=os.environ.get("QUERY_CACHE_MODE", "read_write"),
+                ttl=float(ttl) if ttl else None,
+            )
+        return _default_cache
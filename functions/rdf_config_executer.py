@@ -1,12 +1,16 @@
+import json
 import os
+import queue
 import subprocess
+import tempfile
+import threading
+import time
 
+from .tracing import trace_span
 
-# config/{database}/sparql.yamlに追記するテキストを生成
-def create_strain_text(database, id, variables, parameters):
-    path_config_sparql = (
-        os.environ["PATH_RDF_CONFIG"] + "config/" + database + "/sparql.yaml"
-    )
+
+# config/{database}/sparql.yaml 形式のテキストを生成
+def build_strain_text(id, variables, parameters):
     # ヘッダー部分のテキスト生成
     header = f"\n{id}:\n  variables: ["
     header += ", ".join(variables)
@@ -24,9 +28,18 @@ def create_strain_text(database, id, variables, parameters):
 
     param_text += "  options:\n    distinct: true\n\n"
 
+    return header + param_text
+
+
+# config/{database}/sparql.yamlに追記するテキストを生成
+def create_strain_text(database, id, variables, parameters):
+    path_config_sparql = (
+        os.environ["PATH_RDF_CONFIG"] + "config/" + database + "/sparql.yaml"
+    )
+
     # save path_config_sparql to save_path
     with open(path_config_sparql, "a") as file:
-        file.write(header + param_text)
+        file.write(build_strain_text(id, variables, parameters))
 
 
 # コマンドとそのパラメータをリストとして定義
@@ -36,16 +49,205 @@ def execute_rdf_config(database, id):
     directory_path = os.environ["PATH_RDF_CONFIG"]
 
     # subprocess.runを使用してコマンドを実行
-    try:
+    with trace_span("rdf_config", mode="shell"):
+        try:
+            result = subprocess.run(
+                command,
+                check=True,
+                text=True,
+                capture_output=True,
+                cwd=directory_path,
+                shell=True,
+            )
+        except subprocess.CalledProcessError as e:
+            print("エラーが発生しました:", e)  # エラー内容を表示
+
+    return result.stdout
+
+
+def execute_rdf_config_isolated(database, id, variables, parameters):
+    """
+    Run rdf-config once against a private copy of config/{database} whose sparql.yaml
+    holds only this query, so the shared sparql.yaml is never touched.
+    """
+    directory_path = os.environ["PATH_RDF_CONFIG"]
+    config_dir = os.path.join(directory_path, "config", database)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        # rdf-config はディレクトリ名を config 名として使うので同じ名前にする
+        tmp_config_dir = os.path.join(tmp_dir, database)
+        os.mkdir(tmp_config_dir)
+        for file_name in os.listdir(config_dir):
+            if file_name != "sparql.yaml":
+                os.symlink(os.path.join(config_dir, file_name), os.path.join(tmp_config_dir, file_name))
+        with open(os.path.join(tmp_config_dir, "sparql.yaml"), "w") as file:
+            file.write(build_strain_text(id, variables, parameters))
+
         result = subprocess.run(
-            command,
+            ["bundle", "exec", "rdf-config", "--config", tmp_config_dir, "--sparql", str(id)],
             check=True,
             text=True,
             capture_output=True,
             cwd=directory_path,
-            shell=True,
         )
-    except subprocess.CalledProcessError as e:
-        print("エラーが発生しました:", e)  # エラー内容を表示
 
     return result.stdout
+
+
+def compile_sparql(database, id, variables, parameters, use_server=True):
+    """
+    Generate SPARQL for a variables+parameters spec without writing to config/{database}/sparql.yaml.
+
+    use_server=True sends the spec to the shared rdf-config server kept in memory;
+    use_server=False runs rdf-config once with an isolated temporary config directory.
+    """
+    with trace_span("rdf_config", mode="server" if use_server else "isolated"):
+        if use_server:
+            return execute_rdf_config_server(database, id, variables, parameters)
+        return execute_rdf_config_isolated(database, id, variables, parameters)
+
+
+class RdfConfigServer:
+    """
+    Long-lived rdf-config process for one database (bin/rdf-config-server).
+
+    model.yaml / prefix.yaml / endpoint.yaml are parsed once when the process starts;
+    each compile() sends a variables+parameters spec over stdin and reads the SPARQL
+    from stdout. Per-request latency is kept in `latencies`.
+
+    A response that does not arrive within timeout seconds (RDF_CONFIG_TIMEOUT, default 60)
+    kills the process, which is started again by the next compile(), and raises TimeoutError.
+    """
+
+    def __init__(self, database, command=None, timeout=None):
+        self.database = database
+        if command is None:
+            command = ["bundle", "exec", "ruby", "bin/rdf-config-server", "--config", f"config/{database}"]
+        self.command = command
+        self.timeout = timeout if timeout is not None else float(os.environ.get("RDF_CONFIG_TIMEOUT") or 60)
+        self.latencies = []
+        self._lock = threading.Lock()
+        self._request_id = 0
+        self._process = None
+        self._lines = None
+
+    def start(self):
+        self._process = subprocess.Popen(
+            self.command,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            text=True,
+            bufsize=1,
+            cwd=os.environ["PATH_RDF_CONFIG"],
+        )
+        # readline() に期限を付けられないので、出力は別スレッドで読んでキューに入れる
+        self._lines = queue.Queue()
+        threading.Thread(target=self._read_lines, args=(self._process, self._lines), daemon=True).start()
+        # モデルの読み込みが終わると ready 行が返ってくる
+        ready = self._readline("startup")
+        if not ready:
+            self.kill()
+            raise RuntimeError(f"rdf-config server for {self.database} exited during startup")
+        return self
+
+    @staticmethod
+    def _read_lines(process, lines):
+        for line in process.stdout:
+            lines.put(line)
+        lines.put("")  # 終了
+
+    def _readline(self, what):
+        try:
+            return self._lines.get(timeout=self.timeout)
+        except queue.Empty:
+            self.kill()
+            raise TimeoutError(f"rdf-config server for {self.database} did not answer {what} within {self.timeout:g}s")
+
+    def alive(self):
+        return self._process is not None and self._process.poll() is None
+
+    def compile(self, id, variables, parameters):
+        """
+        Return the SPARQL generated for the spec, the same text `rdf-config --sparql {id}` prints.
+        """
+        with self._lock:
+            if not self.alive():
+                self.start()
+            self._request_id += 1
+            request = {
+                "id": self._request_id,
+                "name": str(id),
+                "yaml": build_strain_text(id, variables, parameters),
+            }
+
+            started = time.perf_counter()
+            try:
+                self._process.stdin.write(json.dumps(request) + "\n")
+                self._process.stdin.flush()
+            except OSError:
+                line = ""  # 落ちている
+            else:
+                line = self._readline(f"request {id}")
+            elapsed = time.perf_counter() - started
+            if not line:
+                self.kill()
+
+        if not line:
+            raise RuntimeError(f"rdf-config server for {self.database} exited")
+        response = json.loads(line)
+        self.latencies.append(elapsed)
+        if "error" in response:
+            raise RuntimeError(f"rdf-config error for {id}: {response['error']}")
+        return response["sparql"]
+
+    def kill(self):
+        if self._process is not None:
+            self._process.kill()
+            self._process.wait()
+        self._process = None
+
+    def close(self):
+        if self.alive():
+            self._process.stdin.close()
+            try:
+                self._process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self._process.kill()
+        self._process = None
+
+
+_servers = {}
+_servers_lock = threading.Lock()
+# database ごとの起動ロック (Ruby の起動中に他の database を待たせない)
+_start_locks = {}
+
+
+def get_rdf_config_server(database):
+    """
+    Return the shared RdfConfigServer for database, starting it on first use.
+    """
+    with _servers_lock:
+        server = _servers.get(database)
+        if server is not None and server.alive():
+            return server
+        start_lock = _start_locks.setdefault(database, threading.Lock())
+    with start_lock:
+        with _servers_lock:
+            server = _servers.get(database)
+        if server is None or not server.alive():
+            server = RdfConfigServer(database).start()
+            with _servers_lock:
+                _servers[database] = server
+        return server
+
+
+def execute_rdf_config_server(database, id, variables, parameters):
+    return get_rdf_config_server(database).compile(id, variables, parameters)
+
+
+def close_rdf_config_servers():
+    with _servers_lock:
+        for server in _servers.values():
+            server.close()
+        _servers.clear()
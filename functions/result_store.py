@@ -0,0 +1,325 @@
+from array import array
+import codecs
+import hashlib
+import json
+import numpy as np
+import os
+import re
+
+# 未束縛のセルを表す値 ID
+UNBOUND = -1
+
+
+class ColumnarResult:
+    """
+    SPARQL result set stored column by column.
+
+    Every distinct value string is kept once in `values`; each column is an array of
+    indexes into it (UNBOUND for a missing binding). Only the "value" of each binding is
+    kept, which is all the evaluators compare.
+    """
+
+    def __init__(self, variables=None):
+        self.variables = list(variables or [])
+        self.values = []
+        self.columns = {var: array("l") for var in self.variables}
+        self._value_ids = {}
+        self._rows = 0
+
+    def __len__(self):
+        return self._rows
+
+    def _intern(self, value):
+        value_id = self._value_ids.get(value)
+        if value_id is None:
+            value_id = len(self.values)
+            self._value_ids[value] = value_id
+            self.values.append(value)
+        return value_id
+
+    def add_variable(self, var):
+        if var not in self.columns:
+            self.variables.append(var)
+            self.columns[var] = array("l", [UNBOUND] * self._rows)
+
+    def append(self, row):
+        """
+        Append one row given as {variable: value string}.
+        """
+        for var in row:
+            self.add_variable(var)
+        for var in self.variables:
+            value = row.get(var)
+            self.columns[var].append(UNBOUND if value is None else self._intern(value))
+        self._rows += 1
+
+    @classmethod
+    def from_bindings(cls, bindings):
+        """
+        Build a result from SPARQL JSON bindings ([{var: {"value": ...}}]).
+        """
+        result = cls()
+        for binding in bindings:
+            result.append({var: term["value"] if isinstance(term, dict) else term for var, term in binding.items()})
+        return result
+
+    def to_bindings(self):
+        """
+        Return the rows in the SPARQL JSON bindings layout ([{var: {"value": ...}}]).
+        """
+        bindings = []
+        for i in range(self._rows):
+            row = {}
+            for var in self.variables:
+                value_id = self.columns[var][i]
+                if value_id != UNBOUND:
+                    row[var] = {"value": self.values[value_id]}
+            bindings.append(row)
+        return bindings
+
+    def save(self, path):
+        with open(path, "w") as f:
+            json.dump(
+                {
+                    "variables": self.variables,
+                    "values": self.values,
+                    "rows": self._rows,
+                    "columns": {var: self.columns[var].tolist() for var in self.variables},
+                },
+                f,
+                ensure_ascii=False,
+            )
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "r") as f:
+            data = json.load(f)
+        result = cls(data["variables"])
+        result.values = data["values"]
+        result._value_ids = {value: i for i, value in enumerate(result.values)}
+        result.columns = {var: array("l", ids) for var, ids in data["columns"].items()}
+        result._rows = data["rows"]
+        return result
+
+
+def iter_json_bindings(chunks):
+    """
+    Yield (head_vars, binding) pairs from a SPARQL JSON response given as an iterable of text chunks,
+    without holding the whole response in memory. head_vars is the "vars" list when it has been seen.
+    """
+    decoder = json.JSONDecoder()
+    chunks = iter(chunks)
+    buffer = ""
+    head_vars = []
+
+    def read_more():
+        nonlocal buffer
+        for chunk in chunks:
+            if chunk:
+                buffer += chunk
+                return True
+        return False
+
+    # "bindings": [ まで読み進める (途中にある head.vars は拾っておく)
+    while True:
+        match = re.search(r'"bindings"\s*:\s*\[', buffer)
+        if match:
+            break
+        if not read_more():
+            raise ValueError("SPARQL JSON response has no results.bindings")
+    vars_match = re.search(r'"vars"\s*:\s*(\[[^\]]*\])', buffer[:match.start()])
+    if vars_match:
+        head_vars = json.loads(vars_match.group(1))
+    buffer = buffer[match.end():]
+
+    pos = 0
+    while True:
+        # 区切り文字と空白を読み飛ばす
+        while True:
+            while pos < len(buffer) and buffer[pos] in " \t\r\n,":
+                pos += 1
+            if pos < len(buffer):
+                break
+            buffer, pos = "", 0
+            if not read_more():
+                raise ValueError("SPARQL JSON response ended inside results.bindings")
+        if buffer[pos] == "]":
+            return
+        try:
+            binding, end = decoder.raw_decode(buffer, pos)
+        except json.JSONDecodeError:
+            # オブジェクトの途中でチャンクが切れている
+            buffer, pos = buffer[pos:], 0
+            if not read_more():
+                raise
+            continue
+        yield head_vars, binding
+        pos = end
+        if pos > 1 << 16:
+            buffer, pos = buffer[pos:], 0
+
+
+_TSV_IRI = re.compile(r"^<(.*)>$")
+_TSV_LITERAL = re.compile(r'^"(.*)"(?:@[A-Za-z0-9-]+|\^\^<[^>]*>)?$', re.DOTALL)
+_TSV_ESCAPES = {"t": "\t", "n": "\n", "r": "\r", "b": "\b", "f": "\f", '"': '"', "'": "'", "\\": "\\"}
+
+
+def tsv_term_value(term):
+    """
+    Convert an RDF term in SPARQL TSV syntax to the "value" string of the JSON format.
+    """
+    match = _TSV_IRI.match(term)
+    if match:
+        return match.group(1)
+    match = _TSV_LITERAL.match(term)
+    if match:
+        return re.sub(
+            r'\\(u[0-9A-Fa-f]{4}|U[0-9A-Fa-f]{8}|.)',
+            lambda m: chr(int(m.group(1)[1:], 16)) if len(m.group(1)) > 1 else _TSV_ESCAPES.get(m.group(1), m.group(1)),
+            match.group(1),
+        )
+    if term.startswith("_:"):
+        return term[2:]
+    # 数値や真偽値の省略形はそのまま
+    return term
+
+
+# 列は encode_bindings (pd.DataFrame) と同じく、値が最初に現れた順に並べる (head.vars の順ではない)。
+# 採点は列の位置で比べるので、ディスクに書き出すかどうかで列順が変わらないようにする
+def parse_json_stream(chunks):
+    result = ColumnarResult()
+    for _, binding in iter_json_bindings(chunks):
+        result.append({var: term["value"] for var, term in binding.items()})
+    return result
+
+
+def parse_tsv_stream(lines):
+    lines = iter(lines)
+    header = next(lines, "")
+    variables = [var.lstrip("?$") for var in header.rstrip("\r\n").split("\t") if var]
+    result = ColumnarResult()
+    for line in lines:
+        line = line.rstrip("\r\n")
+        if not line:
+            continue
+        row = {}
+        for var, term in zip(variables, line.split("\t")):
+            if term:
+                row[var] = tsv_term_value(term)
+        result.append(row)
+    return result
+
+
+def decode_chunks(byte_chunks, encoding="utf-8"):
+    decoder = codecs.getincrementaldecoder(encoding)()
+    for chunk in byte_chunks:
+        yield decoder.decode(chunk)
+    yield decoder.decode(b"", final=True)
+
+
+def spill_path(spill_dir, question_id):
+    return os.path.join(spill_dir, f"{question_id}.json")
+
+
+def load_results(question):
+    """
+    Return the bindings of a question, loading them from question["results_path"] when they were spilled to disk.
+    """
+    if "results_path" in question:
+        return ColumnarResult.load(question["results_path"]).to_bindings()
+    return question["results"]
+
+
+def has_results(question):
+    return "results" in question or "results_path" in question
+
+
+def result_fingerprint(ids, interner):
+    """
+    Deterministic fingerprint of an encoded result, independent of the interner's id numbering.
+
+    Ids are renumbered by first appearance in the result and hashed together with the shape
+    and the distinct value strings in that order, so equal results give equal fingerprints
+    across runs and processes.
+    """
+    flat = ids.ravel()
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(repr(ids.shape).encode())
+    if flat.size:
+        unique_ids, first_index, inverse = np.unique(flat, return_index=True, return_inverse=True)
+        order = np.argsort(first_index, kind="stable")
+        rank = np.empty(len(order), dtype=np.int64)
+        rank[order] = np.arange(len(order))
+        digest.update(rank[inverse].astype("<i8").tobytes())
+        for value_id in unique_ids[order]:
+            value = "\x00unbound" if value_id == UNBOUND else interner.values[value_id]
+            encoded = repr(value).encode("utf-8")
+            digest.update(len(encoded).to_bytes(8, "little") + encoded)
+    return digest.hexdigest()
+
+
+class ValueInterner:
+    """
+    Maps value strings to dense integer ids. Results encoded with the same interner
+    can be compared id by id.
+    """
+
+    def __init__(self):
+        self.ids = {}
+        self.values = []
+
+    def __len__(self):
+        return len(self.values)
+
+    def intern(self, value):
+        value_id = self.ids.get(value)
+        if value_id is None:
+            value_id = len(self.values)
+            self.ids[value] = value_id
+            self.values.append(value)
+        return value_id
+
+
+def encode_bindings(bindings, interner):
+    """
+    Encode SPARQL JSON bindings in one pass as (variables, ids) where ids is a rows x variables
+    int64 array of interned value ids (UNBOUND for a missing binding).
+
+    Variables are ordered by first appearance, the same column order pd.DataFrame(bindings) gives.
+    """
+    column_index = {}
+    columns = []
+    n_rows = len(bindings)
+    intern = interner.intern
+    for i, row in enumerate(bindings):
+        for var, term in row.items():
+            col = column_index.get(var)
+            if col is None:
+                col = column_index[var] = len(columns)
+                columns.append([UNBOUND] * n_rows)
+            value = term["value"] if isinstance(term, dict) and "value" in term else term
+            columns[col][i] = intern(value)
+
+    ids = np.array(columns, dtype=np.int64).T if columns else np.empty((n_rows, 0), dtype=np.int64)
+    return list(column_index), ids
+
+
+def encode_columnar(result, interner):
+    """
+    Encode a ColumnarResult like encode_bindings, remapping its value table instead of visiting each cell.
+    """
+    value_map = np.array([interner.intern(value) for value in result.values] + [UNBOUND], dtype=np.int64)
+    if not result.variables:
+        return [], np.empty((len(result), 0), dtype=np.int64)
+    # UNBOUND (-1) は value_map の末尾を指す
+    ids = np.stack([value_map[np.asarray(result.columns[var], dtype=np.int64)] for var in result.variables], axis=1)
+    return list(result.variables), ids
+
+
+def load_encoded_results(question, interner):
+    """
+    Return (variables, ids) for the results of a question, reading spilled results without rebuilding bindings.
+    """
+    if "results_path" in question:
+        return encode_columnar(ColumnarResult.load(question["results_path"]), interner)
+    return encode_bindings(question["results"] or [], interner)
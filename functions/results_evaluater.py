@@ -3,8 +3,19 @@ import pandas as pd
 from munkres import Munkres
 import numpy as np
 from scipy.optimize import linear_sum_assignment
+from scipy import sparse
+from scipy.sparse.csgraph import connected_components
 from tqdm import tqdm
-import hashlib
+
+from .result_store import (
+    UNBOUND,
+    ValueInterner,
+    has_results,
+    load_encoded_results,
+    result_fingerprint,
+)
+from .score_cache import get_default_score_cache, make_score_key
+from .tracing import trace_span
 
 
 def dict_to_tuple(d):
@@ -26,16 +37,82 @@ def column_similarity(col1: pd.Series, col2: pd.Series) -> float:
     # print(f"Comparing columns:\n{col1.name} vs {col2.name}\nSimilarity: {similarity}")
     return similarity
 
-def find_best_column_matches(df1: pd.DataFrame, df2: pd.DataFrame) -> List[tuple]:
-    similarity_matrix = [
-        [column_similarity(df1[col1], df2[col2]) for col2 in df2.columns]
-        for col1 in df1.columns
+def _encode_columns(df1: pd.DataFrame, df2: pd.DataFrame) -> Tuple[sparse.csr_matrix, sparse.csr_matrix]:
+    """
+    Encode every column of both DataFrames once as the set of its distinct values:
+    a (columns x values) 0/1 sparse matrix with value codes shared by both frames.
+    """
+    columns = []
+    for df in (df1, df2):
+        for col in df.columns:
+            series = df[col]
+            if pd.api.types.is_numeric_dtype(series.dtype):
+                columns.append(series.to_numpy())
+            else:
+                columns.append(np.array([dict_to_tuple(v) for v in series] + [None], dtype=object)[:-1])
+    lengths = [len(c) for c in columns]
+    codes, uniques = pd.factorize(np.concatenate(columns) if columns else np.array([]), use_na_sentinel=False)
+
+    column_index = np.repeat(np.arange(len(columns)), lengths)
+    indicators = sparse.csr_matrix(
+        (np.ones(len(codes), dtype=np.int32), (column_index, codes)), shape=(len(columns), len(uniques))
+    )
+    # 重複を 1 にまとめて集合として扱う
+    indicators.data[:] = 1
+    indicators.sum_duplicates()
+    indicators.data[:] = 1
+    n1 = df1.shape[1]
+    return indicators[:n1], indicators[n1:]
+
+
+def _column_similarity_matrix(df1: pd.DataFrame, df2: pd.DataFrame) -> List[List[float]]:
+    """
+    column_similarity for every (df1 column, df2 column) pair from one sparse product.
+    """
+    indicators1, indicators2 = _encode_columns(df1, df2)
+    intersection = (indicators1 @ indicators2.T).toarray()
+    answer_size = np.asarray(indicators2.sum(axis=1)).ravel()
+    return [
+        [float(intersection[i, j] / answer_size[j]) if answer_size[j] > 0 else 0 for j in range(len(answer_size))]
+        for i in range(intersection.shape[0])
     ]
 
+
+def _unique_optimal_assignment(cost: np.ndarray):
+    """
+    Solve the (rectangular) assignment problem with linear_sum_assignment and return its (row, col)
+    pairs, or None when another assignment has the same cost (then the solver's tie-breaking decides).
+    """
+    row_ind, col_ind = linear_sum_assignment(cost)
+    best = cost[row_ind, col_ind].sum()
+    for r, c in zip(row_ind, col_ind):
+        forbidden = cost.copy()
+        forbidden[r, c] = np.inf
+        try:
+            alt_rows, alt_cols = linear_sum_assignment(forbidden)
+        except ValueError:
+            # 他に割り当てが存在しない
+            continue
+        if forbidden[alt_rows, alt_cols].sum() <= best + 1e-9:
+            return None
+    return list(zip(row_ind.tolist(), col_ind.tolist()))
+
+
+def find_best_column_matches(df1: pd.DataFrame, df2: pd.DataFrame) -> List[tuple]:
+    similarity_matrix = _column_similarity_matrix(df1, df2)
+
     # print(f"Similarity Matrix:\n{similarity_matrix}")
 
-    m = Munkres()
-    indexes = m.compute([[1 - sim for sim in row] for row in similarity_matrix])
+    # Munkres は 0 で正方行列に埋めて解くが、埋めた行・列どうしは常に同点になるので、
+    # 一意性は実際の列どうしの長方形の部分だけで判定する (埋めた行・列のコストは一定なので最適解は同じ)
+    if len(df1.columns) and len(df2.columns):
+        indexes = _unique_optimal_assignment(1 - np.array(similarity_matrix, dtype=float))
+    else:
+        indexes = []
+    if indexes is None:
+        # 最適解が複数ある場合は従来と同じ結果になるよう Munkres で解く
+        m = Munkres()
+        indexes = m.compute([[1 - sim for sim in row] for row in similarity_matrix])
     matches = []
     used_columns = set()
     for row, column in indexes:
@@ -60,47 +137,63 @@ def pad_rows(df1: pd.DataFrame, df2: pd.DataFrame) -> Tuple[pd.DataFrame, pd.Dat
     # print(f"Padded DataFrames:\nDF1:\n{df1_padded}\n\nDF2:\n{df2_padded}")
     return df1_padded, df2_padded
 
+def select_nested_columns(q: Dict[str, Any], a: Dict[str, Any], interner: ValueInterner):
+    """
+    Encode the results of q and a, keeping only q["variables"] columns (in that order).
+    Returns (q_ids, q_columns, a_ids, a_columns).
+    """
+    q_variables, q_ids = load_encoded_results(q, interner)
+    q_columns = [key for key in q["variables"] if key in q_variables]
+    q_ids = q_ids[:, [q_variables.index(key) for key in q_columns]]
+
+    a_variables, a_ids = load_encoded_results(a, interner)
+    a_columns = [key for key in q["variables"] if key in a_variables]
+    a_ids = a_ids[:, [a_variables.index(key) for key in a_columns]]
+    return q_ids, q_columns, a_ids, a_columns
+
+
+def score_nested_ids(q_ids, q_columns, a_ids, a_columns, missing_id) -> Dict[str, Any]:
+    """
+    evaluate_nested_data metrics for one question from encoded results.
+    """
+    if q_ids.size == 0 or a_ids.size == 0:
+        return {"average_match_rate": 0, "column_matches": {}}
+
+    q_ids, a_ids = pad_id_rows(q_ids, a_ids, missing_id)
+    # 値 ID が等しいことと値が等しいことは同じなので、ID のまま列を比較する
+    column_matches = find_best_column_matches(
+        pd.DataFrame(q_ids, columns=q_columns),
+        pd.DataFrame(a_ids, columns=a_columns),
+    )
+    # 行ごとに同じ位置の値が一致する割合 (calculate_match_rate と同じ)
+    n_columns = min(q_ids.shape[1], a_ids.shape[1])
+    row_match_rates = (q_ids[:, :n_columns] == a_ids[:, :n_columns]).sum(axis=1) / q_ids.shape[1]
+
+    return {
+        "average_match_rate": row_match_rates.mean(),
+        "column_matches": column_matches,
+    }
+
+
 def evaluate_nested_data(
     questions: List[Dict[str, Any]], answer: List[Dict[str, Any]]
 ) -> Dict[str, Any]:
     all_metrics = {}
+    interner = ValueInterner()
+    missing_id = interner.intern("missing")  # pad_rows と同じく欠損は "missing" として扱う
     for q, a in zip(questions, answer):
-        try:
-            q_df = pd.DataFrame(q["results"]) if q["results"] else pd.DataFrame()
-            q_df = q_df if q_df.empty else q_df.applymap(lambda x: x["value"])
-            save_columns = [key for key in q["variables"] if key in q_df.columns]
-            q_df = q_df[save_columns]
-
-            a_df = pd.DataFrame(a["results"]) if a["results"] else pd.DataFrame()
-            a_df = a_df if a_df.empty else a_df.applymap(lambda x: x["value"])
-            save_columns = [key for key in q["variables"] if key in a_df.columns]
-            a_df = a_df[save_columns]
-
-            if not q_df.empty and not a_df.empty:
-                q_df, a_df = pad_rows(q_df, a_df)
-                column_matches = find_best_column_matches(q_df, a_df)
-                row_match_rates = []
-                for row_index in range(len(q_df)):
-                    row_pred = q_df.iloc[row_index].tolist()
-                    row_act = a_df.iloc[row_index].tolist()
-                    row_match_rates.append(calculate_match_rate(row_pred, row_act))
-
-                average_match_rate = sum(row_match_rates) / len(row_match_rates)
-                all_metrics[q["id"]] = {
-                    "average_match_rate": average_match_rate,
-                    "column_matches": column_matches,
-                }
-            else:
+        with trace_span("score_nested", question_id=q["id"]) as span:
+            try:
+                q_ids, q_columns, a_ids, a_columns = select_nested_columns(q, a, interner)
+                span.set(rows=int(q_ids.shape[0]))
+                all_metrics[q["id"]] = score_nested_ids(q_ids, q_columns, a_ids, a_columns, missing_id)
+            except Exception as e:
+                print(f"Error processing ID {q['id']}: {e}")
+                span.set(status="error", error=str(e))
                 all_metrics[q["id"]] = {
                     "average_match_rate": 0,
                     "column_matches": {},
                 }
-        except Exception as e:
-            print(f"Error processing ID {q['id']}: {e}")
-            all_metrics[q["id"]] = {
-                "average_match_rate": 0,
-                "column_matches": {},
-            }
     overall_average = {
         "overall_average_match_rate": sum(m["average_match_rate"] for m in all_metrics.values()) / len(all_metrics)
     }
@@ -118,59 +211,184 @@ def evaluate_nested_data(
     return {"overall_average": overall_average, "id_metrics": all_metrics}
 
 
-# Jaccard 係数をベクトル化して計算する関数
-def jaccard_index_vectorized(df1: pd.DataFrame, df2: pd.DataFrame) -> np.ndarray:
-    # print(df1.shape, df2.shape)
-    # NaN を 0 に変換して計算
+def encode_dataframes(df1: pd.DataFrame, df2: pd.DataFrame) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Encode the cells of both DataFrames as shared integer value ids (UNBOUND for NaN).
+    """
+    codes, _ = pd.factorize(
+        np.concatenate([df1.to_numpy(dtype=object).ravel(), df2.to_numpy(dtype=object).ravel()])
+    )
+    split = df1.shape[0] * df1.shape[1]
+    return codes[:split].reshape(df1.shape), codes[split:].reshape(df2.shape)
 
-    df1_numeric = df1.fillna(np.inf).applymap(convert_to_numeric)
-    df2_numeric = df2.fillna(np.inf).applymap(convert_to_numeric)
 
-    df1_numeric = df1_numeric.astype(np.float64)
-    df2_numeric = df2_numeric.astype(np.float64)
+def pad_id_rows(ids1: np.ndarray, ids2: np.ndarray, missing_id: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    pad_rows for encoded results: pad to the same number of rows and fill unbound cells with missing_id.
+    """
+    max_len = max(len(ids1), len(ids2))
 
-    # 列数を揃える（少ない方に np.inf を埋める）
-    max_cols = max(df1_numeric.shape[1], df2_numeric.shape[1])
+    def pad(ids):
+        padded = np.full((max_len, ids.shape[1]), missing_id, dtype=np.int64)
+        padded[: len(ids)] = np.where(ids == UNBOUND, missing_id, ids)
+        return padded
 
-    # df1, df2 両方の列数を max_cols に揃える
-    df1_aligned = np.pad(df1_numeric.values, ((0, 0), (0, max_cols - df1_numeric.shape[1])), constant_values=np.inf)
-    df2_aligned = np.pad(df2_numeric.values, ((0, 0), (0, max_cols - df2_numeric.shape[1])), constant_values=np.inf)
+    return pad(ids1), pad(ids2)
 
-    # 共通部分（交差）の計算、np.inf の場合は交差として数えない
-    intersection = np.logical_and(
-        np.equal(df1_aligned[:, np.newaxis, :], df2_aligned),
-        (df1_aligned[:, np.newaxis, :] != np.inf) & (df2_aligned != np.inf)
-    ).sum(axis=2)
 
-    # 和集合の計算、np.inf は含めない
-    union = (
-        (df1_aligned[:, np.newaxis, :] != np.inf).sum(axis=2) +
-        (df2_aligned != np.inf).sum(axis=1) -
-        intersection
-    )
+def _row_value_indicators(ids1: np.ndarray, ids2: np.ndarray) -> Tuple[sparse.csr_matrix, sparse.csr_matrix]:
+    """
+    One-hot encode (column position, value id) pairs of both encoded results.
+    Unbound cells get no entry, so row i of ids1 and row j of ids2 share a non-zero
+    column exactly where they hold the same value in the same column position.
+    """
+    n_columns = min(ids1.shape[1], ids2.shape[1])
+    n_values = int(max(ids1.max(initial=-1), ids2.max(initial=-1))) + 1
 
-    # Jaccard 係数を計算
-    jaccard_matrix = intersection / union
-    jaccard_matrix[union == 0] = 0  # ゼロ割りを避ける
+    def build(ids):
+        ids = ids[:, :n_columns]
+        rows, cols = np.nonzero(ids >= 0)
+        data = np.ones(len(rows), dtype=np.int32)
+        return sparse.csr_matrix(
+            (data, (rows, cols * n_values + ids[rows, cols])), shape=(len(ids), n_columns * n_values)
+        )
+
+    return build(ids1), build(ids2)
+
+
+def jaccard_index_ids(ids1: np.ndarray, ids2: np.ndarray) -> sparse.csr_matrix:
+    """
+    Row-by-row Jaccard similarity of two encoded results as a sparse matrix (zeros are not stored).
+
+    Cells are compared position by position as in jaccard_index_vectorized, but the
+    intersection counts come from one sparse product of value indicators, so memory
+    scales with the number of overlapping row pairs instead of n x m x columns.
+    """
+    # 欠損していないセルの数 (和集合の計算に使う)
+    counts1 = (ids1 >= 0).sum(axis=1)
+    counts2 = (ids2 >= 0).sum(axis=1)
+
+    indicators1, indicators2 = _row_value_indicators(ids1, ids2)
+    intersection = (indicators1 @ indicators2.T).tocoo()
+
+    union = counts1[intersection.row] + counts2[intersection.col] - intersection.data
+    jaccard = intersection.data / union
+    return sparse.csr_matrix((jaccard, (intersection.row, intersection.col)), shape=(len(ids1), len(ids2)))
+
+
+def jaccard_index_sparse(df1: pd.DataFrame, df2: pd.DataFrame) -> sparse.csr_matrix:
+    return jaccard_index_ids(*encode_dataframes(df1, df2))
+
+
+# Jaccard 係数をベクトル化して計算する関数
+def jaccard_index_vectorized(df1: pd.DataFrame, df2: pd.DataFrame) -> np.ndarray:
+    return jaccard_index_sparse(df1, df2).toarray()
+
+
+def _component_assignment(block: sparse.csr_matrix) -> Tuple[np.ndarray, np.ndarray]:
+    # 行か列が 1 つしかない成分は最大値を取るだけでよい
+    if block.shape[0] == 1 or block.shape[1] == 1:
+        dense = block.toarray()
+        r, c = np.unravel_index(np.argmax(dense), dense.shape)
+        return np.array([r]), np.array([c])
+    return linear_sum_assignment(block.toarray(), maximize=True)
+
+
+def _greedy_assignment(matrix: sparse.csr_matrix) -> Tuple[np.ndarray, np.ndarray]:
+    coo = matrix.tocoo()
+    order = np.argsort(-coo.data, kind="stable")
+    used_rows = np.zeros(matrix.shape[0], dtype=bool)
+    used_cols = np.zeros(matrix.shape[1], dtype=bool)
+    rows, cols = [], []
+    for r, c in zip(coo.row[order], coo.col[order]):
+        if not used_rows[r] and not used_cols[c]:
+            used_rows[r] = used_cols[c] = True
+            rows.append(r)
+            cols.append(c)
+    return np.array(rows, dtype=np.int64), np.array(cols, dtype=np.int64)
+
+
+def max_weight_matching_sparse(
+    matrix: sparse.csr_matrix, method: str = "exact"
+) -> Tuple[np.ndarray, np.ndarray, float]:
+    """
+    Maximum weight assignment on a sparse, non-negative similarity matrix.
+
+    The bipartite graph of non-zero entries is split into connected components and each one is
+    solved on its own (single-row / single-column components by taking the maximum), which gives
+    the same total as linear_sum_assignment on the whole matrix. method="greedy" takes edges in
+    decreasing weight instead; its total is at least half of the optimum.
+
+    Returns (row_ind, col_ind, upper_bound) where upper_bound >= the optimal total
+    (equal to it for method="exact").
+    """
+    matrix = sparse.csr_matrix(matrix)
+    matrix.eliminate_zeros()
+    n_rows, n_cols = matrix.shape
+    if matrix.nnz == 0:
+        empty = np.array([], dtype=np.int64)
+        return empty, empty, 0.0
+
+    if method == "greedy":
+        row_ind, col_ind = _greedy_assignment(matrix)
+        total = float(np.asarray(matrix[row_ind, col_ind]).sum())
+        row_max_sum = float(matrix.max(axis=1).sum())
+        col_max_sum = float(matrix.max(axis=0).sum())
+        return row_ind, col_ind, min(row_max_sum, col_max_sum, 2 * total)
+    if method != "exact":
+        raise ValueError(f"Unknown matching method: {method}")
+
+    adjacency = sparse.bmat([[None, matrix], [matrix.T, None]], format="csr")
+    _, labels = connected_components(adjacency, directed=False)
+    row_labels, col_labels = labels[:n_rows], labels[n_rows:]
+
+    # ラベルごとに行・列をまとめる
+    row_order = np.argsort(row_labels, kind="stable")
+    col_order = np.argsort(col_labels, kind="stable")
+    row_groups = np.split(row_order, np.flatnonzero(np.diff(row_labels[row_order])) + 1)
+    col_groups = {col_labels[g[0]]: g for g in np.split(col_order, np.flatnonzero(np.diff(col_labels[col_order])) + 1)}
+
+    row_parts, col_parts = [], []
+    for rows in row_groups:
+        cols = col_groups.get(row_labels[rows[0]])
+        if cols is None:
+            # 辺のない行
+            continue
+        r, c = _component_assignment(matrix[rows][:, cols])
+        row_parts.append(rows[r])
+        col_parts.append(cols[c])
+
+    row_ind = np.concatenate(row_parts)
+    col_ind = np.concatenate(col_parts)
+    total = float(np.asarray(matrix[row_ind, col_ind]).sum())
+    return row_ind, col_ind, total
 
-    return jaccard_matrix
 
 # 最大重みマッチングと平均スコアを計算する関数
-def calculate_max_weight_matching(df1, df2):
+def calculate_max_weight_matching(df1, df2, method="exact", return_upper_bound=False):
     df1, df2 = pad_rows(df1, df2)
-    # 類似度行列を計算
-    similarity_matrix = jaccard_index_vectorized(df1, df2)
+    ids1, ids2 = encode_dataframes(df1, df2)
+    return max_weight_matching_ids(ids1, ids2, method, return_upper_bound)
+
 
-    row_sums = similarity_matrix.sum(axis=1)
-    col_sums = similarity_matrix.sum(axis=0)
+def max_weight_matching_ids(ids1, ids2, method="exact", return_upper_bound=False):
+    """
+    calculate_max_weight_matching on encoded results that have already been padded (see pad_id_rows).
+    """
+    # 類似度行列を計算 (疎行列)
+    similarity_matrix = jaccard_index_ids(ids1, ids2)
+    positive = similarity_matrix > 0
+
+    row_sums = np.asarray(similarity_matrix.sum(axis=1)).ravel()
+    col_sums = np.asarray(similarity_matrix.sum(axis=0)).ravel()
 
     # 全ての要素が0の行・列を除外するためのマスクを作成
     non_zero_row_mask = row_sums != 0
     non_zero_col_mask = col_sums != 0
 
     # 条件に基づき、ある座標が0以上で他は0の行・列を固定
-    fixed_row_mask = (similarity_matrix > 0).sum(axis=1) == 1  # 1つの列だけが0以上
-    fixed_col_mask = (similarity_matrix > 0).sum(axis=0) == 1  # 1つの行だけが0以上
+    fixed_row_mask = np.asarray(positive.sum(axis=1)).ravel() == 1  # 1つの列だけが0以上
+    fixed_col_mask = np.asarray(positive.sum(axis=0)).ravel() == 1  # 1つの行だけが0以上
 
     dynamic_row_mask = non_zero_row_mask & ~fixed_row_mask
     dynamic_col_mask = non_zero_col_mask & ~fixed_col_mask
@@ -178,8 +396,8 @@ def calculate_max_weight_matching(df1, df2):
     # 非ゼロかつ固定されていない部分をフィルタリング
     filtered_matrix = similarity_matrix[dynamic_row_mask][:, dynamic_col_mask]
 
-    # `linear_sum_assignment` を最大化モードで実行
-    row_ind, col_ind = linear_sum_assignment(filtered_matrix, maximize=True)
+    # 連結成分ごとに最大重みマッチングを解く
+    row_ind, col_ind, upper_bound = max_weight_matching_sparse(filtered_matrix, method)
 
     # 元の行列に対応するインデックスに戻す
     original_row_ind = np.where(dynamic_row_mask)[0][row_ind]
@@ -190,79 +408,79 @@ def calculate_max_weight_matching(df1, df2):
     fixed_col_ind = np.where(fixed_col_mask)[0]
 
     # 対応するスコア（固定行・列のスコアも含む）
-    matching_scores = similarity_matrix[original_row_ind, original_col_ind]
+    if len(original_row_ind) > 0:
+        matching_scores = np.asarray(similarity_matrix[original_row_ind, original_col_ind]).ravel()
+    else:
+        matching_scores = np.zeros(0)
+    fixed_total = 0.0
     if len(fixed_row_ind) > 0 and len(fixed_col_ind) > 0:
-        # np.ix_ を使って行と列のペアを指定してスコアを取得
-        fixed_scores = similarity_matrix[np.ix_(fixed_row_ind, fixed_col_ind)]
-        matching_scores = np.concatenate((matching_scores, fixed_scores.ravel()))
+        # 固定行・列の部分行列のうち非ゼロのスコアだけを加える (0 は合計に影響しない)
+        fixed_scores = similarity_matrix[fixed_row_ind][:, fixed_col_ind]
+        matching_scores = np.concatenate((matching_scores, fixed_scores.data))
+        fixed_total = fixed_scores.sum()
 
     # 行数が異なる場合の補正 (ペアがないものは0)
-    total_rows = max(len(df1), len(df2))
+    total_rows = max(len(ids1), len(ids2))
     avg_score = np.sum(matching_scores) / total_rows
 
+    if return_upper_bound:
+        return matching_scores, avg_score, (upper_bound + fixed_total) / total_rows
     return matching_scores, avg_score
 
-# DataFrameのハッシュを作成するための関数
-def hash_dataframe(df: pd.DataFrame) -> str:
-    df_str = df.to_string()
-    return hashlib.md5(df_str.encode()).hexdigest()
+def score_jaccard_ids(q_ids: np.ndarray, a_ids: np.ndarray, missing_id: int) -> float:
+    """
+    Jaccard score of one question from encoded (unpadded) results.
+    """
+    q_padded, a_padded = pad_id_rows(q_ids, a_ids, missing_id)
+    jaccard_scores, avg_jaccard = max_weight_matching_ids(q_padded, a_padded)
+    return float(avg_jaccard)
 
 
-# Fill missing values with np.inf and handle non-numeric data by hashing
-def convert_to_numeric(value):
-    # 数値型かどうかをチェックして、数値ならそのまま返し、文字列ならハッシュ化
-    if pd.api.types.is_numeric_dtype(type(value)):
-        return value  # 数値型はそのまま
-    else:
-        return hash(value) 
-
 def evaluate_jaccard(
-    questions: List[Dict[str, Any]], answers: List[Dict[str, Any]]
+    questions: List[Dict[str, Any]], answers: List[Dict[str, Any]], score_cache=None
 ) -> Dict[str, Any]:
+    """
+    Jaccard score of each question's results against the answer's results.
+
+    Scores are memoized by result fingerprint, within the run and in score_cache
+    (a DiskCache, or the one configured by SCORE_CACHE_DIR) across runs and processes.
+    """
     all_metrics = {}
     cache = {}  # キャッシュを保存する辞書
+    if score_cache is None:
+        score_cache = get_default_score_cache()
+    interner = ValueInterner()
+    missing_id = interner.intern("missing")  # pad_rows と同じく欠損は "missing" として扱う
 
     for q, a in tqdm(zip(questions, answers), total=len(questions), desc="Evaluating"):
         # if q.keys()に"results"がない場合スキップ
-        if "results" not in q.keys():
+        if not has_results(q):
             print(f"Skipping {q['id']} due to missing results.")
             all_metrics[q["id"]] = {"jaccard_score": 0}
             continue
 
-        # 質問のDataFrame
-        q_df = pd.DataFrame(q["results"]) if q["results"] else pd.DataFrame()
-        q_df = q_df if q_df.empty else q_df.applymap(lambda x: x["value"] if isinstance(x, dict) and "value" in x else x)
+        # 質問・回答の結果を値 ID の配列に変換
+        _, q_ids = load_encoded_results(q, interner)
+        _, a_ids = load_encoded_results(a, interner)
 
-        # 回答のDataFrame
-        a_df = pd.DataFrame(a["results"]) if a["results"] else pd.DataFrame()
-        a_df = a_df if a_df.empty else a_df.applymap(lambda x: x["value"] if isinstance(x, dict) and "value" in x else x)
-
-
-        # print(q_df.shape, a_df.shape)
-
-        # print(q_df)
-
-        # print(a_df)
-        # データフレームに列がない場合はスキップ
-        if q_df.shape[0] == 0 or q_df.shape[1] == 0:
+        # 結果に行か列がない場合はスキップ
+        if q_ids.shape[0] == 0 or q_ids.shape[1] == 0:
             print(f"Skipping {q['id']} due to empty columns.")
             all_metrics[q["id"]] = {"jaccard_score": 0}
             continue
 
-        # DataFrameのハッシュを作成
-        q_hash = hash_dataframe(q_df)
-        a_hash = hash_dataframe(a_df)
-
-        # ハッシュキーでキャッシュを確認
-        cache_key = (q_hash, a_hash)
+        # 結果のフィンガープリントからキャッシュキーを作成
+        cache_key = make_score_key("jaccard", result_fingerprint(q_ids, interner), result_fingerprint(a_ids, interner))
         if cache_key in cache:
-            #print("Cache hit", q["id"])
             # キャッシュが存在する場合、キャッシュを使用
             jaccard_result = cache[cache_key]
         else:
             # 存在しない場合は計算し、キャッシュに保存
-            #print("Cache miss", q["id"])
-            jaccard_scores, avg_jaccard = calculate_max_weight_matching(q_df, a_df)
+            def score():
+                with trace_span("score", question_id=q["id"], rows=int(q_ids.shape[0])):
+                    return score_jaccard_ids(q_ids, a_ids, missing_id)
+
+            avg_jaccard = score() if score_cache is None else score_cache.get_or_call(cache_key, score)
             jaccard_result = {"jaccard_score": avg_jaccard}
             cache[cache_key] = {"jaccard_score": avg_jaccard}
 
@@ -0,0 +1,158 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from .disk_cache import DiskCache
+from .tracing import trace_set
+
+
+class RunStore:
+    """
+    Checkpoint of a benchmark run: one record per question per stage.
+
+    A record is keyed on (stage, question id, hash of the stage inputs) and holds the stage output.
+    Records are appended to a JSONL file, or stored in SQLite when path ends with .sqlite / .db;
+    either way a run that is interrupted can be restarted with the same store and only the stages
+    whose inputs changed (or never finished) are recomputed. The JSONL backend keeps only the
+    file offset of each record in memory and reads the output back on get().
+
+    Large stage outputs (query results) are written under results_dir ({path without extension}_results)
+    and the records only refer to them.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.backend = "sqlite" if path.endswith((".sqlite", ".db")) else "jsonl"
+        self.results_dir = os.path.splitext(path)[0] + "_results"
+        self.reused = {}
+        self.computed = {}
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        if self.backend == "sqlite":
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS records ("
+                "stage TEXT, question_id TEXT, input_hash TEXT, output TEXT, created REAL, "
+                "PRIMARY KEY (stage, question_id, input_hash))"
+            )
+            self._db.commit()
+        else:
+            # キー → ファイル上の位置 (出力そのものはメモリに持たない)
+            self._index = {}
+            self._load_jsonl()
+            self._file = open(path, "ab")
+            self._reader = open(path, "rb")
+            if self._file.tell():
+                # 書き込み途中で止まった行の後ろに続けて書かないようにする
+                self._reader.seek(-1, os.SEEK_END)
+                if self._reader.read(1) != b"\n":
+                    self._file.write(b"\n")
+                    self._file.flush()
+
+    def _load_jsonl(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "rb") as f:
+            offset = 0
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # 書き込み途中で止まった最終行は無視する
+                    offset += len(line)
+                    continue
+                self._index[(record["stage"], record["question_id"], record["input_hash"])] = offset
+                offset += len(line)
+
+    @staticmethod
+    def hash_inputs(inputs):
+        return DiskCache.hash_key(inputs)
+
+    def get(self, stage, question_id, input_hash):
+        """
+        Return the stored output, or None when the stage has not been recorded for these inputs.
+        """
+        question_id = str(question_id)
+        with self._lock:
+            if self.backend == "jsonl":
+                offset = self._index.get((stage, question_id, input_hash))
+                if offset is None:
+                    return None
+                self._reader.seek(offset)
+                return json.loads(self._reader.readline())["output"]
+            row = self._db.execute(
+                "SELECT output FROM records WHERE stage = ? AND question_id = ? AND input_hash = ?",
+                (stage, question_id, input_hash),
+            ).fetchone()
+        return None if row is None else json.loads(row[0])
+
+    def put(self, stage, question_id, input_hash, output):
+        question_id = str(question_id)
+        with self._lock:
+            if self.backend == "jsonl":
+                record = {
+                    "stage": stage,
+                    "question_id": question_id,
+                    "input_hash": input_hash,
+                    "created": time.time(),
+                    "output": output,
+                }
+                offset = self._file.tell()
+                self._file.write((json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8"))
+                self._file.flush()
+                self._index[(stage, question_id, input_hash)] = offset
+            else:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO records VALUES (?, ?, ?, ?, ?)",
+                    (stage, question_id, input_hash, json.dumps(output, ensure_ascii=False), time.time()),
+                )
+                self._db.commit()
+
+    def results_path(self, stage, question_id, input_hash):
+        """
+        Where a stage stores the large part of its output for these inputs.
+        """
+        return os.path.join(self.results_dir, stage, f"{question_id}.{input_hash[:16]}.json")
+
+    def run(self, stage, question_id, inputs, call, reuse=None):
+        """
+        Return the recorded output of stage for these inputs, or run call() and record its output.
+        An output of None (a failed stage) is returned but not recorded, so the next run retries it.
+        reuse(output), if given, decides whether a recorded output is still usable.
+        """
+        input_hash = self.hash_inputs(inputs)
+        output = self.get(stage, question_id, input_hash)
+        if output is not None and (reuse is None or reuse(output)):
+            self._count(self.reused, stage)
+            trace_set(reused=True)
+            return output
+        output = call()
+        self._count(self.computed, stage)
+        if output is not None:
+            self.put(stage, question_id, input_hash, output)
+        return output
+
+    def _count(self, counter, stage):
+        with self._lock:
+            counter[stage] = counter.get(stage, 0) + 1
+
+    def stats(self):
+        return {"reused": dict(self.reused), "computed": dict(self.computed)}
+
+    def close(self):
+        with self._lock:
+            if self.backend == "jsonl":
+                self._file.close()
+                self._reader.close()
+            else:
+                self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
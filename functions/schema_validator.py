@@ -0,0 +1,167 @@
+"""
+Checks the variables and parameters extracted from the LLM output against the rdf-config
+model (rdf-config/config/{db}/model.yaml, prefix.yaml) before the spec is compiled, and builds
+a repair hint for the next LLM call.
+"""
+import difflib
+import os
+import re
+import threading
+
+# model.yaml は rdf-config 独自の書き方 (キー "[]:"、タブ) を含み YAML ローダーで読めないので、行単位で読む
+_ITEM_PATTERN = re.compile(r"^(\s*)-\s+(.*?)\s*$")
+_COMMENT_PATTERN = re.compile(r"\s+#.*$")
+_PREFIX_PATTERN = re.compile(r"^\s*([\w.-]*)\s*:\s*<([^>]*)>")
+_PREFIXED_NAME_PATTERN = re.compile(r"^([A-Za-z][\w.-]*)?:(\S*)$")
+# data/prompt/prompts.json の指示で LLM が名前に付ける prefix。prefix.yaml にはないが受け付ける
+RESOURCE_PREFIX = "res"
+
+
+def load_prefixes(path):
+    prefixes = {}
+    with open(path, "r") as f:
+        for line in f:
+            match = _PREFIX_PATTERN.match(line)
+            if match:
+                prefixes[match.group(1)] = match.group(2)
+    return prefixes
+
+
+def load_model(path):
+    """
+    Return (subjects, objects): {subject name: example}, {object variable name: example value}.
+    """
+    subjects, objects = {}, {}
+    stack = []  # (indent, role)
+    with open(path, "r") as f:
+        for line in f:
+            match = _ITEM_PATTERN.match(line.expandtabs(8))
+            if not match or line.lstrip().startswith("#"):
+                continue
+            indent, content = len(match.group(1)), _COMMENT_PATTERN.sub("", match.group(2))
+            while stack and stack[-1][0] >= indent:
+                stack.pop()
+            parent = stack[-1][1] if stack else None
+            if parent is None:
+                name, _, example = content.rstrip(":").partition(" ")
+                subjects[name] = example.strip()
+                role = "subject"
+            elif parent in ("subject", "blank_node"):
+                role = "predicate"
+            elif parent == "predicate":
+                if content.startswith("[]"):
+                    role = "blank_node"
+                else:
+                    name, _, example = content.partition(":")
+                    objects.setdefault(name.strip(), example.strip())
+                    role = "object"
+            else:
+                role = "value"
+            stack.append((indent, role))
+    return subjects, objects
+
+
+class SchemaValidator:
+    """
+    Variable names and IRI-valued variables of one database's rdf-config model.
+    """
+
+    def __init__(self, subjects, objects, prefixes):
+        self.subjects = subjects
+        self.objects = objects
+        self.prefixes = prefixes
+        self.variables = set(subjects) | set(objects)
+        # 値が IRI になる変数 (主語、または例が主語名か prefix 付きの名前)
+        self.iri_variables = set(subjects) | {
+            name for name, example in objects.items() if example in subjects or self._is_prefixed(example)
+        }
+
+    @classmethod
+    def load(cls, config_dir):
+        subjects, objects = load_model(os.path.join(config_dir, "model.yaml"))
+        return cls(subjects, objects, load_prefixes(os.path.join(config_dir, "prefix.yaml")))
+
+    def _is_prefixed(self, value):
+        match = _PREFIXED_NAME_PATTERN.match(value)
+        return bool(match) and (match.group(1) or "") in self.prefixes
+
+    def _suggest(self, name):
+        matches = difflib.get_close_matches(name, self.variables, n=3, cutoff=0.6)
+        return f" Did you mean {', '.join(matches)}?" if matches else ""
+
+    def validate(self, variables, parameters):
+        """
+        Return a list of problems (empty if the spec can be compiled).
+        """
+        problems = []
+        # "a,b" は sparql.yaml では [a,b] として複数の変数になる
+        names = [name.strip() for variable in variables for name in variable.split(",") if name.strip()]
+        for variable in names:
+            if variable not in self.variables:
+                problems.append(f"Unknown variable '{variable}'.{self._suggest(variable)}")
+        for key, value in parameters.items():
+            key, value = key.strip(), value.strip()
+            if key not in self.variables:
+                problems.append(f"Unknown condition variable '{key}'.{self._suggest(key)}")
+                continue
+            if key not in self.iri_variables or value.startswith("<"):
+                continue
+            match = _PREFIXED_NAME_PATTERN.match(value)
+            if not match:
+                example = self.subjects.get(key) or self.objects.get(key)
+                problems.append(f"The value of '{key}' must be a prefixed IRI like {example}, not '{value}'.")
+            elif (match.group(1) or "") not in self.prefixes and match.group(1) != RESOURCE_PREFIX:
+                problems.append(
+                    f"Unknown prefix '{match.group(1)}:' in '{key}: {value}'. "
+                    f"Use one of: {', '.join(p + ':' for p in self.prefixes)}."
+                )
+        return problems
+
+
+def repair_hint(problems):
+    """
+    Text appended to the prompt when the previous answer was rejected.
+    """
+    lines = ["", "", "[FEEDBACK]", "The previous answer could not be used:"]
+    lines += [f"- {problem}" for problem in problems]
+    lines.append("Answer again in the same format, using only variable names from [variables_info].")
+    return "\n".join(lines)
+
+
+class SchemaError(Exception):
+    def __init__(self, problems):
+        super().__init__("; ".join(problems))
+        self.problems = problems
+
+
+_validators = {}
+_validators_lock = threading.Lock()
+
+
+def get_schema_validator(database):
+    """
+    Return the SchemaValidator of database (loaded once per model / prefix file version), or None without a model.
+    """
+    config_dir = os.path.join(os.environ["PATH_RDF_CONFIG"], "config", database)
+    try:
+        signature = tuple(
+            os.stat(os.path.join(config_dir, name)).st_mtime_ns for name in ("model.yaml", "prefix.yaml")
+        )
+    except FileNotFoundError:
+        return None
+    with _validators_lock:
+        cached = _validators.get(config_dir)
+        if cached is None or cached[0] != signature:
+            cached = _validators[config_dir] = (signature, SchemaValidator.load(config_dir))
+        return cached[1]
+
+
+def check_spec(database, variables, parameters):
+    """
+    Raise SchemaError if the variables / parameters do not fit the database's model.
+    """
+    validator = get_schema_validator(database)
+    if validator is not None:
+        problems = validator.validate(variables, parameters)
+        if problems:
+            raise SchemaError(problems)
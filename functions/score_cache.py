@@ -0,0 +1,37 @@
+import os
+import threading
+
+from .disk_cache import DiskCache
+
+# スコアの計算方法を変えたら上げる (古いキャッシュを使わないため)
+SCORE_VERSION = 1
+
+
+def make_score_key(metric, predicted_fingerprint, gold_fingerprint):
+    """
+    Key of a (predicted, gold) score pair, built from result fingerprints.
+    """
+    return DiskCache.hash_key(
+        {"metric": metric, "version": SCORE_VERSION, "predicted": predicted_fingerprint, "gold": gold_fingerprint}
+    )
+
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+
+def get_default_score_cache():
+    """
+    Return the cache configured by SCORE_CACHE_DIR / SCORE_CACHE_MAX_BYTES, or None.
+    """
+    global _default_cache
+    cache_dir = os.environ.get("SCORE_CACHE_DIR")
+    if not cache_dir:
+        return None
+    with _default_cache_lock:
+        if _default_cache is None or _default_cache.cache_dir != cache_dir:
+            _default_cache = DiskCache(
+                cache_dir,
+                max_bytes=int(os.environ.get("SCORE_CACHE_MAX_BYTES", 256 * 1024 ** 2)),
+            )
+        return _default_cache
@@ -0,0 +1,203 @@
+"""
+Long-running natural-language-to-SPARQL service around make_one_prompt + generate_one_sparql.
+
+    python -m functions.sparql_service --databases rhea uniprot --port 8000
+    curl -d '{"database": "rhea", "question": "..."}' localhost:8000/sparql
+"""
+from collections import OrderedDict
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import argparse
+import json
+import os
+import threading
+import time
+import uuid
+
+from .gpt_excute import get_client
+from .prompt_maker import ONE_PROMPT_IDS, get_prompt_catalog, make_one_prompt
+from .rdf_config_executer import close_rdf_config_servers, get_rdf_config_server
+from .SPARQL_executer import execute_one_query
+from .SPARQL_generator import generate_one_sparql
+from .tracing import trace_context, trace_span
+
+
+def normalize_question(question):
+    return " ".join(question.split())
+
+
+class SparqlService:
+    """
+    Answers single questions with warm clients and compilers.
+
+    warm() creates the OpenAI client, loads the prompt catalog and starts one rdf-config server
+    per database before the first request. Each request is compiled under its own id, at most
+    max_concurrency requests generate at once, and answers are memoized (LRU of memo_size
+    entries) by database and whitespace-normalized question; identical requests that arrive
+    while one is being answered wait for it instead of calling the LLM again.
+    """
+
+    def __init__(self, databases, max_concurrency=8, memo_size=1024, use_server=True, endpoints=None):
+        self.databases = list(databases)
+        self.use_server = use_server
+        self.memo_size = memo_size
+        self.endpoints = endpoints or {}
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self._memo = OrderedDict()
+        self._in_flight = {}
+        self._lock = threading.Lock()
+
+    def warm(self):
+        get_client()
+        catalog = get_prompt_catalog()
+        for database in self.databases:
+            catalog.get(database, *ONE_PROMPT_IDS[database])
+            if self.use_server:
+                get_rdf_config_server(database)
+        return self
+
+    def endpoint(self, database):
+        return self.endpoints.get(database) or os.environ[f"ENDPOINT_{database.upper()}"]
+
+    def _generate(self, database, question, execute, request_id):
+        with self._slots, trace_context(database=database, question_id=request_id):
+            with trace_span("service_generate"):
+                sparql = generate_one_sparql(
+                    database, make_one_prompt(database, question), use_server=self.use_server, request_id=request_id
+                )
+            if sparql is None:
+                raise RuntimeError("SPARQL generation failed")
+            answer = {"sparql": sparql}
+            if execute:
+                answer["results"] = execute_one_query(sparql, self.endpoint(database))
+            return answer
+
+    def answer(self, database, question, execute=False):
+        """
+        Return {"request_id", "database", "sparql", ("results"), "cached", "seconds"} for one question.
+        """
+        if database not in ONE_PROMPT_IDS:
+            raise ValueError(f"Unknown database: {database}")
+        started = time.perf_counter()
+        request_id = f"SPARQL-{uuid.uuid4().hex[:12]}"
+        key = (database, normalize_question(question), bool(execute))
+
+        with self._lock:
+            answer = self._memo.get(key)
+            if answer is not None:
+                self._memo.move_to_end(key)
+            future = self._in_flight.get(key) if answer is None else None
+            owner = answer is None and future is None
+            if owner:
+                future = self._in_flight[key] = Future()
+
+        if owner:
+            try:
+                answer = self._generate(database, question, execute, request_id)
+            except Exception as e:
+                with self._lock:
+                    self._in_flight.pop(key, None)
+                future.set_exception(e)
+                raise
+            with self._lock:
+                self._memo[key] = answer
+                if len(self._memo) > self.memo_size:
+                    self._memo.popitem(last=False)
+                self._in_flight.pop(key, None)
+            future.set_result(answer)
+        elif answer is None:
+            # 同じ質問を処理中のリクエストの結果を待つ
+            answer = future.result()
+
+        return {
+            "request_id": request_id,
+            "database": database,
+            **answer,
+            "cached": not owner,
+            "seconds": time.perf_counter() - started,
+        }
+
+    def close(self):
+        if self.use_server:
+            close_rdf_config_servers()
+
+
+def make_handler(service):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def send_json(self, status, payload):
+            data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            if self.path == "/health":
+                self.send_json(200, {"status": "ok", "databases": service.databases})
+            else:
+                self.send_json(404, {"error": "not found"})
+
+        def do_POST(self):
+            if self.path != "/sparql":
+                self.send_json(404, {"error": "not found"})
+                return
+            try:
+                request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+                database, question = request["database"], request["question"]
+            except (ValueError, KeyError, TypeError) as e:
+                self.send_json(400, {"error": f"bad request: {e}"})
+                return
+            try:
+                self.send_json(200, service.answer(database, question, request.get("execute", False)))
+            except ValueError as e:
+                self.send_json(400, {"error": str(e)})
+            except Exception as e:
+                self.send_json(502, {"error": str(e)})
+
+    return Handler
+
+
+def serve(service, host="127.0.0.1", port=8000):
+    """
+    Return a started ThreadingHTTPServer (one thread per request) for the service:
+    POST /sparql {"database", "question", "execute"} and GET /health.
+    """
+    server = ThreadingHTTPServer((host, port), make_handler(service))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Natural-language-to-SPARQL service")
+    parser.add_argument("--databases", nargs="+", default=sorted(ONE_PROMPT_IDS), choices=sorted(ONE_PROMPT_IDS))
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--max-concurrency", type=int, default=8)
+    parser.add_argument("--memo-size", type=int, default=1024)
+    parser.add_argument("--no-server", action="store_true", help="run rdf-config once per request instead of the server")
+    args = parser.parse_args()
+
+    service = SparqlService(args.databases, args.max_concurrency, args.memo_size, not args.no_server).warm()
+    server = serve(service, args.host, args.port)
+    print(f"serving {', '.join(args.databases)} on http://{args.host}:{server.server_port}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.shutdown()
+        service.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,233 @@
+from contextvars import ContextVar
+import json
+import os
+import threading
+import time
+
+import numpy as np
+
+# 集計する数値フィールド
+COUNTERS = ("retries", "schema_rejects", "prompt_tokens", "completion_tokens", "bytes", "rows")
+
+_current_span = ContextVar("trace_span", default=None)
+_context = ContextVar("trace_context", default={})
+
+
+class Tracer:
+    """
+    Collects one record per span: stage, database, question id, start time, wall seconds,
+    status / error and counters (retries, tokens, bytes, rows). Records are kept in memory
+    and, when path is given, appended to a JSONL file as they finish.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.records = []
+        self._lock = threading.Lock()
+        self._file = None
+        if path:
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._file = open(path, "a")
+
+    def emit(self, record):
+        with self._lock:
+            self.records.append(record)
+            if self._file is not None:
+                self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+                self._file.flush()
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+class Span:
+    def __init__(self, tracer, stage, fields):
+        self.tracer = tracer
+        self.record = {"stage": stage, **_context.get(), **fields}
+
+    def add(self, name, value=1):
+        self.record[name] = self.record.get(name, 0) + value
+
+    def set(self, **fields):
+        self.record.update(fields)
+
+    def __enter__(self):
+        self._token = _current_span.set(self)
+        self.record["start"] = time.time()
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.record["seconds"] = time.perf_counter() - self._started
+        if exc is not None:
+            self.record["status"] = "error"
+            self.record["error"] = f"{type(exc).__name__}: {exc}"
+        else:
+            self.record.setdefault("status", "ok")
+        _current_span.reset(self._token)
+        self.tracer.emit(self.record)
+        return False
+
+
+class _NoopSpan:
+    def add(self, name, value=1):
+        pass
+
+    def set(self, **fields):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NOOP_SPAN = _NoopSpan()
+_tracer = None
+_env_checked = False
+_tracer_lock = threading.Lock()
+
+
+def enable_tracing(path=None):
+    """
+    Start recording spans (in memory, and appended to path as JSONL when given). Returns the Tracer.
+    """
+    global _tracer, _env_checked
+    with _tracer_lock:
+        if _tracer is not None:
+            _tracer.close()
+        _tracer = Tracer(path)
+        _env_checked = True
+        return _tracer
+
+
+def disable_tracing():
+    global _tracer, _env_checked
+    with _tracer_lock:
+        if _tracer is not None:
+            _tracer.close()
+        _tracer = None
+        _env_checked = True
+
+
+def get_tracer():
+    """
+    Return the active Tracer, or None. Tracing starts on first use when TRACE_PATH is set.
+    """
+    global _env_checked
+    if _tracer is None and not _env_checked:
+        with _tracer_lock:
+            _env_checked = True
+            path = os.environ.get("TRACE_PATH")
+        if path:
+            enable_tracing(path)
+    return _tracer
+
+
+def trace_span(stage, **fields):
+    """
+    Context manager timing one stage. Use span.add("retries") / span.set(rows=...) on the returned span;
+    database and question_id come from trace_context. A no-op when tracing is off.
+    """
+    tracer = _tracer if _env_checked else get_tracer()
+    if tracer is None:
+        return _NOOP_SPAN
+    return Span(tracer, stage, fields)
+
+
+def trace_add(name, value=1):
+    """
+    Add to a counter of the innermost open span.
+    """
+    span = _current_span.get()
+    if span is not None:
+        span.add(name, value)
+
+
+def trace_set(**fields):
+    """
+    Set fields of the innermost open span.
+    """
+    span = _current_span.get()
+    if span is not None:
+        span.set(**fields)
+
+
+class trace_context:
+    """
+    Context manager setting fields (e.g. database, question_id) for every span opened inside it.
+    """
+
+    def __init__(self, **fields):
+        self.fields = fields
+
+    def __enter__(self):
+        self._token = _context.set({**_context.get(), **self.fields})
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        _context.reset(self._token)
+        return False
+
+
+def load_trace(path):
+    with open(path, "r") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def summarize_trace(records, group_by=("database", "stage")):
+    """
+    Per (database, stage): count, errors, p50 / p95 / max wall seconds and counter totals.
+    """
+    groups = {}
+    for record in records:
+        key = tuple(record.get(field) for field in group_by)
+        groups.setdefault(key, []).append(record)
+
+    rows = []
+    for key, group in sorted(groups.items(), key=lambda item: tuple(str(k) for k in item[0])):
+        seconds = np.array([r["seconds"] for r in group])
+        row = dict(zip(group_by, key))
+        row.update(
+            {
+                "count": len(group),
+                "errors": sum(r.get("status") == "error" for r in group),
+                "p50": float(np.percentile(seconds, 50)),
+                "p95": float(np.percentile(seconds, 95)),
+                "max": float(seconds.max()),
+            }
+        )
+        for counter in COUNTERS:
+            row[counter] = sum(r.get(counter, 0) for r in group)
+        rows.append(row)
+    return rows
+
+
+def format_trace_summary(rows):
+    columns = [c for c in rows[0] if c not in COUNTERS] if rows else []
+    # 全行 0 のカウンタは表示しない
+    columns += [c for c in COUNTERS if any(row[c] for row in rows)]
+    widths = {c: max(len(c), *(len(_format_cell(row[c])) for row in rows)) for c in columns}
+    lines = ["  ".join(c.rjust(widths[c]) for c in columns)]
+    for row in rows:
+        lines.append("  ".join(_format_cell(row[c]).rjust(widths[c]) for c in columns))
+    return "\n".join(lines)
+
+
+def _format_cell(value):
+    if isinstance(value, float):
+        return f"{value:.3f}"
+    return str(value)
+
+
+if __name__ == "__main__":
+    import sys
+
+    # python -m functions.tracing trace.jsonl
+    print(format_trace_summary(summarize_trace(load_trace(sys.argv[1]))))
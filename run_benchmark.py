@@ -0,0 +1,130 @@
+"""
+Headless benchmark runner: make_prompt → sparql_gen → execute_query → evaluate_jaccard
+for one database without Jupyter.
+
+    python run_benchmark.py --database rhea --concurrency 8 --llm-cache-dir .cache/llm
+
+Every stage is checkpointed in a run store (--store), so an interrupted run is resumed by
+running the same command again.
+"""
+import argparse
+import json
+import os
+import time
+
+from dotenv import load_dotenv
+
+from functions.prompt_maker import DEFAULT_PROMPT_IDS
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--database", required=True, choices=sorted(DEFAULT_PROMPT_IDS))
+    parser.add_argument("--prompt-id", type=int, help="default: the demo notebook's id for the database")
+    parser.add_argument("--prompt-variable-id", type=int, help="default: the demo notebook's id for the database")
+    parser.add_argument("--difficulty", default="EASY", choices=["EASY", "MEDIUM", "HARD"], help="label used in the default store / output paths")
+    parser.add_argument("--questions", help="questions JSON (default: questions/json_format/{database}.json)")
+    parser.add_argument("--answers", help="questions JSON with gold results (default: execute the reference queries)")
+    parser.add_argument("--gold-index", action="store_true", help="take gold results from the compiled gold index (functions.gold_index)")
+    parser.add_argument("--endpoint", help="default: ENDPOINT_{DATABASE} from the environment")
+    parser.add_argument("--limit", type=int, default=10000, help="LIMIT appended to every query")
+    parser.add_argument("--concurrency", type=int, default=4, help="concurrent LLM generations")
+    parser.add_argument("--execute-concurrency", type=int, help="concurrent query executions (default: --concurrency)")
+    parser.add_argument("--max-retry", type=int, default=3)
+    parser.add_argument("--no-server", action="store_true", help="run rdf-config once per question instead of the server")
+    parser.add_argument("--store", help="run store, .jsonl or .sqlite (default: data/runs/{difficulty}_{database}.jsonl)")
+    parser.add_argument("--output", help="questions JSON with results (default: data/questions/{difficulty}_question_augmented_{database}.json)")
+    parser.add_argument("--llm-cache-dir", help="sets LLM_CACHE_DIR")
+    parser.add_argument("--llm-cache-mode", choices=["read_write", "replay"], help="sets LLM_CACHE_MODE")
+    parser.add_argument("--query-cache-dir", help="sets QUERY_CACHE_DIR")
+    parser.add_argument("--score-cache-dir", help="sets SCORE_CACHE_DIR")
+    parser.add_argument("--trace", help="append per-stage trace records to this JSONL file")
+    parser.add_argument("--verbose", action="store_true")
+    return parser.parse_args()
+
+
+def apply_cache_options(args):
+    # キャッシュは環境変数で設定される (get_default_cache などが参照する)
+    for option, name in (
+        ("llm_cache_dir", "LLM_CACHE_DIR"),
+        ("llm_cache_mode", "LLM_CACHE_MODE"),
+        ("query_cache_dir", "QUERY_CACHE_DIR"),
+        ("score_cache_dir", "SCORE_CACHE_DIR"),
+    ):
+        value = getattr(args, option)
+        if value is not None:
+            os.environ[name] = value
+
+
+def main():
+    load_dotenv()
+    args = parse_args()
+    apply_cache_options(args)
+
+    # 環境変数を設定してから読み込む
+    from functions.gold_index import get_gold_index
+    from functions.pipeline import run_pipeline
+    from functions.rdf_config_executer import close_rdf_config_servers
+    from functions.run_store import RunStore
+    from functions.tracing import enable_tracing, format_trace_summary, summarize_trace
+
+    db = args.database
+    level = args.difficulty.lower()
+    default_prompt_id, default_prompt_variable_id = DEFAULT_PROMPT_IDS[db]
+    prompt_id = args.prompt_id if args.prompt_id is not None else default_prompt_id
+    prompt_variable_id = args.prompt_variable_id if args.prompt_variable_id is not None else default_prompt_variable_id
+    endpoint = args.endpoint or os.environ[f"ENDPOINT_{db.upper()}"]
+
+    with open(args.questions or f"questions/json_format/{db}.json", "r") as f:
+        questions = json.load(f)
+    answers = None
+    if args.answers:
+        with open(args.answers, "r") as f:
+            answers = json.load(f)
+    elif args.gold_index:
+        answers = get_gold_index(db).answers_for(questions)
+        if len(answers) < len(questions):
+            raise SystemExit(
+                f"The gold index has results for {len(answers)} of {len(questions)} questions; "
+                "build it with --results or run without --gold-index"
+            )
+
+    tracer = enable_tracing(args.trace)
+    started = time.perf_counter()
+    with RunStore(args.store or f"data/runs/{level}_{db}.jsonl") as store:
+        try:
+            score = run_pipeline(
+                store,
+                db,
+                questions,
+                answers,
+                prompt_id,
+                prompt_variable_id,
+                endpoint,
+                limit_number=args.limit,
+                verbose=args.verbose,
+                generate_workers=args.concurrency,
+                execute_workers=args.execute_concurrency or args.concurrency,
+                max_retry=args.max_retry,
+                use_server=not args.no_server,
+            )
+        finally:
+            close_rdf_config_servers()
+        stats = store.stats()
+    wall = time.perf_counter() - started
+
+    save_path = args.output or f"data/questions/{level}_question_augmented_{db}.json"
+    os.makedirs(os.path.dirname(save_path) or ".", exist_ok=True)
+    with open(save_path, "w") as f:
+        json.dump(questions, f, indent=2)
+
+    tracer.close()
+    if tracer.records:
+        print(format_trace_summary(summarize_trace(tracer.records)))
+    print(f"wall time {wall:.2f}s, throughput {len(questions) / wall if wall > 0 else 0:.2f} questions/s")
+    print(f"run store: reused {stats['reused']}, computed {stats['computed']}")
+    print(f"overall_average_jaccard_score: {score['overall_average_jaccard_score']:.4f}")
+    print(f"saved to {save_path}")
+
+
+if __name__ == "__main__":
+    main()
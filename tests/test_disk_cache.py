@@ -0,0 +1,18 @@
+import pytest
+
+from functions.disk_cache import CacheMiss, DiskCache
+
+
+def test_cached_none_is_a_hit(tmp_path):
+    cache = DiskCache(str(tmp_path))
+    calls = []
+    for _ in range(2):
+        assert cache.get_or_call("key", lambda: calls.append(1)) is None
+    assert len(calls) == 1
+    assert cache.stats() == {"hits": 1, "misses": 1}
+
+    # replay モードでもキャッシュされた None は返り、未登録のキーだけが CacheMiss になる
+    replay = DiskCache(str(tmp_path), mode="replay")
+    assert replay.get_or_call("key", lambda: 1 / 0) is None
+    with pytest.raises(CacheMiss):
+        replay.get_or_call("other", lambda: 1 / 0)
@@ -0,0 +1,26 @@
+from functions.results_evaluater import evaluate_jaccard
+from functions.SPARQL_executer import run_query
+
+SNAPSHOT = """\
+<http://example.org/e1> <http://example.org/r> <http://example.org/x1> .
+<http://example.org/e2> <http://example.org/r> <http://example.org/x2> .
+<http://example.org/e3> <http://example.org/r> <http://example.org/x3> .
+"""
+# rdflib は束縛を照合した順 (?e, ?r) に並べる
+QUERY = "SELECT DISTINCT ?r ?e WHERE { ?e <http://example.org/r> ?r }"
+
+
+def test_local_bindings_follow_select_order(tmp_path, monkeypatch):
+    monkeypatch.delenv("SCORE_CACHE_DIR", raising=False)
+    snapshot = tmp_path / "snapshot.nt"
+    snapshot.write_text(SNAPSHOT)
+    local = run_query(QUERY, f"local:{snapshot}")
+    assert all(list(binding) == ["r", "e"] for binding in local)
+
+    # エンドポイントと同じ順 (SELECT の順) に並んだ同じ結果
+    endpoint = [
+        {"r": {"type": "uri", "value": f"http://example.org/x{i}"}, "e": {"type": "uri", "value": f"http://example.org/e{i}"}}
+        for i in range(1, 4)
+    ]
+    scores = evaluate_jaccard([{"id": "q", "results": local}], [{"id": "q", "results": endpoint}])
+    assert scores["overall_average_jaccard_score"] == 1.0
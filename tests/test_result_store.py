@@ -0,0 +1,27 @@
+import json
+
+import numpy as np
+
+from functions.result_store import ValueInterner, encode_bindings, encode_columnar, parse_json_stream, parse_tsv_stream
+
+# 1 行目で ?b が未束縛
+RESPONSE = {
+    "head": {"vars": ["b", "a"]},
+    "results": {
+        "bindings": [
+            {"a": {"type": "literal", "value": "a1"}},
+            {"b": {"type": "literal", "value": "b2"}, "a": {"type": "literal", "value": "a2"}},
+        ]
+    },
+}
+TSV = ["?b\t?a\n", '\t"a1"\n', '"b2"\t"a2"\n']
+
+
+def test_spilled_and_in_memory_results_have_the_same_columns():
+    interner = ValueInterner()
+    variables, ids = encode_bindings(RESPONSE["results"]["bindings"], interner)
+    assert variables == ["a", "b"]
+    for result in (parse_json_stream([json.dumps(RESPONSE)]), parse_tsv_stream(TSV)):
+        spilled_variables, spilled_ids = encode_columnar(result, interner)
+        assert spilled_variables == variables
+        assert np.array_equal(spilled_ids, ids)
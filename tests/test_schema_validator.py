@@ -0,0 +1,44 @@
+import os
+
+from functions.schema_validator import SchemaValidator
+from functions.text_extractor import extract_conditions_variables, extract_variable_names
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# demo_propose_model.ipynb の LLM 出力 (prompts.json の指示どおり名前に res: を付けている)
+LLM_OUTPUT = """1. Variables
+What does user look for:
+- Chebi ID
+variables to look for based on elements in [variables_info]:
+- compound_chebi
+
+2. Conditions
+conditions to narrow down:
+- D-tryptophan分子
+variables to narrow down based on elements in [variables_info]. Upper variables and conditions should be connected entity like Compound:
+- Compound
+condition and variable (If it's a name, use a full name with underscore URI and prefix res:) pair:
+- {Compound: res:D-tryptophan}
+"""
+
+
+def load_validator(database):
+    return SchemaValidator.load(os.path.join(REPO_DIR, "rdf-config", "config", database))
+
+
+def test_res_prefixed_value_from_llm_output_is_accepted():
+    variables = extract_variable_names(LLM_OUTPUT)
+    parameters = extract_conditions_variables(LLM_OUTPUT)
+    assert parameters == {"Compound": "res:D-tryptophan"}
+    assert load_validator("rhea").validate(variables, parameters) == []
+
+
+def test_unknown_prefix_is_still_rejected():
+    problems = load_validator("rhea").validate(["compound_chebi"], {"Compound": "foo:D-tryptophan"})
+    assert len(problems) == 1 and "Unknown prefix 'foo:'" in problems[0]
+
+
+def test_comma_separated_variables_from_gold_spec_are_accepted():
+    # questions/json_format/bgee.json の Q12-* の正解
+    variables = ["expression_level,expression_condition_developmental_stage"]
+    assert load_validator("bgee").validate(variables, {"gene_name": "APOC1"}) == []